@@ -8,9 +8,9 @@ from __future__ import print_function
 import os, sys, re, codecs, fileinput
 
 import pipeline
-from pipeline import new_concept_from_token, new_amr_from_old
+from pipeline import new_concept_from_token, update_amr
 
-def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, completed):
+def main(sentenceId, sentence, tokens, ww, wTags, depParse, inAMR, alignment, completed):
     amr = inAMR
     for deps in depParse:
         if deps is None: continue
@@ -44,7 +44,7 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
                     newtriple = (str(x), 'mod', str(y))
                 
                 
-                amr = new_amr_from_old(amr, new_triples=[newtriple])
+                update_amr(amr, new_triples=[newtriple])
                 
                 completed[1][(h,i)] = True
 
@@ -60,12 +60,13 @@ def simplify_adv(w):
     E.g. seriously -> serious. If not found in the lexicon, return the input.'''
     global adv_adj_lex
     if adv_adj_lex is None:
-        adv_adj_lex = {}
+        lex = {}    # published only once complete, so that an interrupted load is retried
         with codecs.open('adj-adv-pairs.txt', 'r', 'utf-8') as lexF:
             for ln in lexF:
                 adj, adv = ln[:-1].split('\t')
-                if adv not in adv_adj_lex or len(adv_adj_lex[adv])>len(adj):
-                    adv_adj_lex[adv] = adj
+                if adv not in lex or len(lex[adv])>len(adj):
+                    lex[adv] = adj
+        adv_adj_lex = lex
     return adv_adj_lex.get(w,w)
 
 def sample_dep_parse():
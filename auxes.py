@@ -8,7 +8,7 @@ from __future__ import print_function
 import os, sys, re, codecs, fileinput
 
 import pipeline
-from pipeline import new_concept_from_token, new_amr_from_old
+from pipeline import new_concept_from_token, update_amr
 
 MODALS = {'will': '', 
           'would': '',
@@ -27,7 +27,7 @@ ACTION_ARG = {'obligate-01': 'ARG2', 'permit-01': 'ARG1', 'possible': 'domain',
 
 # TODO: other modalities not expressed exclusively in the auxiliary: e.g. 'would rather', 'likely/able/permitted/have to'
 
-def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, completed):
+def main(sentenceId, sentence, tokens, ww, wTags, depParse, inAMR, alignment, completed):
     amr = inAMR
     for deps in depParse:
         if deps is None: continue
@@ -61,7 +61,7 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
                 
                 newtriple = (str(x), ACTION_ARG[mpred], str(y))
 
-                amr = new_amr_from_old(amr, new_triples=[newtriple])
+                update_amr(amr, new_triples=[newtriple])
 
                 completed[1][(itm['gov_idx'],i)] = True
 
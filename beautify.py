@@ -6,13 +6,12 @@ Cleans up superficial issues in the AMR, such as deleting unnecessary :-DUMMY re
 @since: 2012-08-08
 '''
 from __future__ import print_function
-import os, sys, re, codecs, fileinput
+import os, sys, re, codecs, fileinput, bisect
 
 import pipeline, config
-from pipeline import new_concept, new_amr, new_amr_from_old, loadCoref, choose_head
-from alignment import Alignment
+from pipeline import new_concept, new_amr, new_amr_from_old, update_amr, ensure_quant, loadCoref, choose_head
 
-def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, completed):
+def main(sentenceId, sentence, tokens, ww, wTags, depParse, inAMR, alignment, completed):
     amr = inAMR
     
     
@@ -47,19 +46,27 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
             continue
         replacements[y] = x
 
-    # Avoid a chain of replacements, e.g. a -> b and b -> c
-    # Assume there are no cycles, otherwise this will loop infinitely
-    while set(replacements.keys()) & set(replacements.values()):
-        for k in replacements.keys():
-            if replacements[k] in replacements:
-                assert replacements[k]!=k,('Self-coreferent?',k,'in',sentenceId,replacements)
-                replacements[k] = replacements[replacements[k]]
-                break
+    # Resolve chains of replacements, e.g. a -> b and b -> c, as in a disjoint-set forest:
+    # each variable points towards the end of its chain, which is the one that is kept
+    def find(v):
+        path = []
+        seen = set()
+        while v in replacements:
+            assert v not in seen,('Self-coreferent?',v,'in',sentenceId,replacements)
+            seen.add(v)
+            path.append(v)
+            v = replacements[v]
+        for k in path:  # path compression
+            replacements[k] = v
+        return v
+    for k in replacements.keys():
+        find(k)
     
     # MERGE the coreferent nodes
     
     all_triples = []
-    trip2tokAlignment = Alignment('many2one') # source side indexes 'all_triples'
+    trip2positions = {}  # triple -> its (ascending) indices in 'all_triples'
+    trip2tokAlignment = {}  # index in 'all_triples' -> token offset
     
     newtriples = []
     oldtriples = coref_triples
@@ -79,7 +86,8 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
             oldtriples.append(trip)
             
         if isinstance(b,basestring) and b in amr.node_to_concepts and alignment[int(b):] is not None:
-            trip2tokAlignment.link(len(all_triples), alignment[int(b):])
+            trip2tokAlignment[len(all_triples)] = alignment[int(b):]
+        trip2positions.setdefault((a,r,b), []).append(len(all_triples))
         all_triples.append((a,r,b))
         
         
@@ -91,7 +99,7 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
         amr.node_to_concepts[k] = v.replace('-FALLBACK_PRON','').replace('-FALLBACK','').replace('-DATE_RELATIVE','').replace('-DATE','').replace('-TIME','')
     
     if config.verbose:
-        print('Triple-to-token alignment:',{trip:ww[trip2tokAlignment[t:]]+'-'+str(trip2tokAlignment[t:]) for t,trip in enumerate(all_triples) if trip2tokAlignment[t:] is not None},
+        print('Triple-to-token alignment:',{trip:ww[trip2tokAlignment[t]]+'-'+str(trip2tokAlignment[t]) for t,trip in enumerate(all_triples) if t in trip2tokAlignment},
               file=sys.stderr)
     
     
@@ -119,12 +127,15 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
         newtrip = (t1[0],t1[1],t2[2])
         assert newtrip[0]!=newtrip[2]
         # replace t1 and t2 with newtrip
-        amr = new_amr_from_old(amr, new_triples=[newtrip], avoid_triples=[t1,t2])
+        amr = update_amr(amr, new_triples=[newtrip], avoid_triples=[t1,t2])
         if config.verbose: print('merge CARDINAL:',[t1,t2],'->',newtrip, file=sys.stderr)
         
-        t = all_triples.index(t1)
-        #assert trip2tokAlignment[t:] is not None
+        t = trip2positions[t1].pop(0)   # first occurrence of t1
+        if not trip2positions[t1]:
+            del trip2positions[t1]
+        #assert t in trip2tokAlignment
         all_triples[t] = newtrip
+        bisect.insort(trip2positions.setdefault(newtrip, []), t)
         #assert trip2tokAlignment[all_triples.index(t2):] is None
         
         #amr = new_amr([(old2newvars.get(x,x), r, (old2newvars.get(y,y),)) for x,r,(y,) in amr.triples(instances=False) if x!=v], amr.node_to_concepts)
@@ -140,25 +151,22 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
             v2 += str(sum(1 for k in newconcepts.keys() if k[0]==v2))
         newconcepts[v2] = c
         old2newvars[v] = v2
+    finalAlignment = {}
     all_triples2 = []
-    trip2tokAlignment2 = Alignment('many2one')
     for x,r,(y,) in amr.triples(instances=False):
-        t = all_triples.index((x,r,y))
-        if trip2tokAlignment[t:] is not None:
-            trip2tokAlignment2.link(len(all_triples2), trip2tokAlignment[t:])
-        all_triples2.append((old2newvars.get(x,x), r, (old2newvars.get(y,y),)))
+        t = trip2positions[(x,r,y)][0]
+        trip = (old2newvars.get(x,x), r, (old2newvars.get(y,y),))
+        if t in trip2tokAlignment:
+            finalAlignment[trip] = ww[trip2tokAlignment[t]]+'-'+str(trip2tokAlignment[t])
+        all_triples2.append(trip)
     
-    finalAlignment = {trip:ww[trip2tokAlignment2[t:]]+'-'+str(trip2tokAlignment2[t:]) for t,trip in enumerate(all_triples2) if trip2tokAlignment2[t:] is not None}
     if config.verbose:
         print('Final triple-to-token alignment:',finalAlignment,
               file=sys.stderr)
     
-    amr = new_amr(all_triples2, newconcepts)
-    
-    
     # detect orphans (variables with no triples)
     orphans = {v: True for v in newconcepts}
-    for x,r,(y,) in amr.triples(instances=False):
+    for x,r,(y,) in all_triples2:
         if r=='-DUMMY': continue
         orphans[x] = False
         if y in orphans:
@@ -166,8 +174,11 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
     orphans = [v for v in orphans if orphans[v]]
     if config.verbose: print(len(orphans),'orphans',orphans, file=sys.stderr)
     
-    # ensure a node has a :-DUMMY annotation iff it is an orphan
-    amr = new_amr([(x,r,(y,)) for x,r,(y,) in amr.triples(instances=False) if r!='-DUMMY']+[(o,'-DUMMY','') for o in orphans], newconcepts)
+    # ensure a node has a :-DUMMY annotation iff it is an orphan:
+    # build the AMR with the new variable names, then replace the :-DUMMY triples in place
+    amr = new_amr(all_triples2, newconcepts)
+    amr.update(ensure_quant([(o,'-DUMMY','') for o in orphans]), [trip for trip in all_triples2 if trip[1]=='-DUMMY'],
+               warn=(sys.stderr if config.verbose else None), reject_cycles=config.rejectCycles)
     
     
     def swap_callback((x,r,(y,)),(x2,r2,(y2,))):
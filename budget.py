@@ -0,0 +1,127 @@
+'''
+Per-sentence and per-stage resource budgets for error-tolerant mode.
+While a budget is active, a periodic timer signal checks the elapsed wall-clock
+time and the growth of the process's resident memory since the sentence or stage
+started, and raises BudgetExceeded in the running code once a limit is exceeded, so that a pathological sentence
+(e.g. a non-terminating loop in a pipeline step) can be abandoned. Memory is
+measured as growth because CPython rarely returns freed memory to the system,
+so the process's total would keep later sentences over the limit.
+
+Signals can only be handled in the main thread; elsewhere, budgets are only
+checked between stages.
+
+@see: config.sentenceTimeLimit, config.stageTimeLimit, config.memoryLimit, config.stageMemoryLimit
+'''
+from __future__ import print_function
+import os, time, signal, threading
+from contextlib import contextmanager
+
+import config
+
+CHECK_INTERVAL = 0.05
+'''Seconds between budget checks'''
+
+class BudgetExceeded(BaseException):
+    '''
+    Raised when a sentence or stage exceeds its budget. Derives from BaseException
+    (like KeyboardInterrupt) so that error handling in pipeline steps does not swallow it.
+    '''
+    def __init__(self, resource, scope, stage, limit, used):
+        BaseException.__init__(self, resource, scope, stage, limit, used)
+        self.resource = resource    # 'time' (seconds) or 'memory' (MB of growth)
+        self.scope = scope          # 'sentence' or 'stage'
+        self.stage = stage          # stage running when the budget was exceeded, if any
+        self.limit = limit
+        self.used = used
+
+    def reason(self):
+        return {'aborted': self.resource, 'scope': self.scope, 'stage': self.stage,
+                'limit': self.limit, 'used': round(self.used, 3)}
+
+    def __str__(self):
+        return '{} budget of {} exceeded ({}{})'.format(self.scope, self.limit, self.used,
+                                                       ' in stage '+self.stage if self.stage else '')
+
+_PAGE_MB = os.sysconf('SC_PAGE_SIZE')/float(2**20) if hasattr(os, 'sysconf') else None
+
+def rss_mb():
+    '''Resident set size of this process in megabytes, or None if unavailable.'''
+    try:
+        with open('/proc/self/statm') as statmF:
+            return int(statmF.read().split()[1])*_PAGE_MB
+    except (IOError, IndexError, ValueError, TypeError):
+        return None
+
+def enabled():
+    return config.errorTolerant and (config.sentenceTimeLimit or config.stageTimeLimit or config.memoryLimit or config.stageMemoryLimit)
+
+class Budget(object):
+    '''The budget of one sentence. Use as a context manager around processing of the
+    sentence, and stage() around each stage. Does nothing unless budgets are enabled.'''
+    def __init__(self):
+        self.enabled = enabled()
+        self.stageName = None
+        self._stageStart = None
+        self._startRss = self._stageRss = None
+        self._active = False
+        self._signals = isinstance(threading.current_thread(), threading._MainThread)
+
+    def __enter__(self):
+        self._start = time.time()
+        self._startRss = self._rss()
+        self._active = self.enabled
+        if self._active and self._signals:
+            self._oldHandler = signal.signal(signal.SIGALRM, self._on_alarm)
+            signal.siginterrupt(signal.SIGALRM, False)  # restart interrupted system calls
+            signal.setitimer(signal.ITIMER_REAL, CHECK_INTERVAL, CHECK_INTERVAL)
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.enabled: return
+        self._active = False
+        if self._signals:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self._oldHandler)
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        self.check()
+        self.stageName, self._stageStart, self._stageRss = name, time.time(), self._rss()
+        try:
+            yield
+            self.check()
+        finally:
+            self.stageName = self._stageStart = self._stageRss = None
+
+    def _rss(self):
+        return rss_mb() if self.enabled and (config.memoryLimit or config.stageMemoryLimit) else None
+
+    def check(self):
+        '''Raises BudgetExceeded if a limit has been exceeded.'''
+        stageName = self.stageName
+        now = time.time()
+        if config.sentenceTimeLimit and now-self._start > config.sentenceTimeLimit:
+            raise BudgetExceeded('time', 'sentence', stageName, config.sentenceTimeLimit, now-self._start)
+        if config.stageTimeLimit and self._stageStart is not None and now-self._stageStart > config.stageTimeLimit:
+            raise BudgetExceeded('time', 'stage', stageName, config.stageTimeLimit, now-self._stageStart)
+        if config.memoryLimit or config.stageMemoryLimit:
+            rss = rss_mb()
+            if rss is None: return
+            if config.memoryLimit and self._startRss is not None and rss-self._startRss > config.memoryLimit:
+                raise BudgetExceeded('memory', 'sentence', stageName, config.memoryLimit, rss-self._startRss)
+            stageRss = self._stageRss
+            if config.stageMemoryLimit and stageRss is not None and rss-stageRss > config.stageMemoryLimit:
+                raise BudgetExceeded('memory', 'stage', stageName, config.stageMemoryLimit, rss-stageRss)
+
+    def _on_alarm(self, signum, frame):
+        if self._active:
+            self._active = False    # raise only once
+            try:
+                self.check()
+            except BudgetExceeded:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                raise
+            self._active = True
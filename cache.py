@@ -0,0 +1,119 @@
+'''
+On-disk cache of pipeline results, so that reruns skip sentences whose output
+cannot have changed. An entry holds the printed output (AMR, alignments, messages)
+of one sentence and is keyed by a hash of the sentence JSON, the config settings
+that affect output, and the pipeline code and lexicon files.
+
+Entries are written atomically (write to a temporary file, then rename),
+so a cache directory can be shared by parallel workers and concurrent runs.
+Reading an entry refreshes its modification time; prune() evicts the least
+recently used entries to keep the cache within a size bound.
+
+@see: pipeline.py options --cache and --cache-size
+'''
+from __future__ import print_function
+import os, sys, json, glob, hashlib, tempfile, errno
+import cPickle as pickle
+
+import config
+
+LEXICONS = ['nombank-deverbals-combined.txt', 'adj-adv-pairs.txt']
+'''Data files read by pipeline steps (relative to the working directory)'''
+
+VOLATILE = {'nProcesses', 'timingReport', 'profileDir', 'cacheDir', 'cacheSize',
+            'sentenceTimeLimit', 'stageTimeLimit', 'memoryLimit', 'stageMemoryLimit',   # budget aborts are not cached
+            'outputFile', 'outputFormat', 'progressInterval'}
+'''Config settings that do not affect the output of a sentence'''
+
+_fingerprint = None
+
+def code_fingerprint():
+    '''Hash of the pipeline sources and lexicon files, computed once per process.'''
+    global _fingerprint
+    if _fingerprint is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        h = hashlib.sha1()
+        sources = sorted(glob.glob(os.path.join(root, '*.py')) + glob.glob(os.path.join(root, 'dev', 'amr', '*.py')))
+        for path in sources + LEXICONS:
+            h.update(os.path.relpath(path, root) if os.path.isabs(path) else path)
+            h.update('\0')
+            if os.path.exists(path):
+                with open(path, 'rb') as inF:
+                    h.update(inF.read())
+            h.update('\0')
+        _fingerprint = h.hexdigest()
+    return _fingerprint
+
+def config_fingerprint():
+    settings = {k: v for k,v in vars(config).items() if not k.startswith('_') and k not in VOLATILE
+                and isinstance(v, (bool, int, long, float, basestring, list, type(None)))}
+    settings['outputFile'] = bool(config.outputFile)    # output is a record for the writer, rather than printed
+    return json.dumps(settings, sort_keys=True)
+
+class ResultCache(object):
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, sentence):
+        '''Cache key for the SentenceRecord 'sentence' under the current code and config.'''
+        h = hashlib.sha1()
+        h.update(code_fingerprint())
+        h.update(config_fingerprint())
+        h.update(sentence.sentenceId.encode('utf-8'))
+        h.update(json.dumps({k: v for k,v in sentence.data.items() if k!='id'}, sort_keys=True))    # 'id' is present in shards
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:]+'.pkl')
+
+    def get(self, key):
+        '''@return: the stored result, or None on a miss'''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as inF:
+                result = pickle.load(inF)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path, None)    # mark as recently used
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, result):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as ex:
+            if ex.errno!=errno.EEXIST: raise
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as outF:
+                pickle.dump(result, outF, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+
+    def prune(self, maxBytes):
+        '''Deletes least recently used entries until the cache takes up at most 'maxBytes'.
+        @return: number of entries deleted'''
+        entries = []
+        for d in glob.glob(os.path.join(self.directory, '??')):
+            for path in glob.glob(os.path.join(d, '*.pkl')):
+                try:
+                    st = os.stat(path)
+                except OSError:     # deleted concurrently
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for mtime,size,path in entries)
+        nDeleted = 0
+        for mtime,size,path in sorted(entries):
+            if total<=maxBytes: break
+            try:
+                os.unlink(path)
+                nDeleted += 1
+            except OSError:
+                pass
+            total -= size
+        return nDeleted
@@ -0,0 +1,156 @@
+'''
+Which tokens and dependency edges of a sentence have been accounted for in the semantics.
+This is the 'completed' state passed through the pipeline steps: completed[0][i] is whether
+token i has been accounted for, and completed[1][(h,i)] whether the edge from head h to
+dependent i has (a KeyError if the parse has no such edge and no step has marked it).
+
+Both are bitsets; edges get dense ids in order of their dependents, so the edges
+within a span of tokens are found without looking at the rest of the sentence.
+
+@see: pipeline.process_sentence()
+'''
+from __future__ import print_function
+
+class TokenFlags(object):
+    '''
+    One flag per token, indexed like a list of bools.
+    >>> t = TokenFlags(5)
+    >>> t[2] = True
+    >>> t.mark_range(3, 4)
+    >>> list(t), t[-1]
+    ([False, False, True, True, True], True)
+    >>> t[5]
+    Traceback (most recent call last):
+      ...
+    IndexError: token index out of range
+    '''
+    __slots__ = ('_n', '_bits')
+
+    def __init__(self, n):
+        self._n = n
+        self._bits = 0
+
+    def _index(self, i):
+        if i<0:
+            i += self._n
+        if not 0<=i<self._n:
+            raise IndexError('token index out of range')
+        return i
+
+    def __getitem__(self, i):
+        return bool(self._bits>>self._index(i) & 1)
+
+    def __setitem__(self, i, v):
+        if v:
+            self._bits |= 1<<self._index(i)
+        else:
+            self._bits &= ~(1<<self._index(i))
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        bits = self._bits
+        return (bool(bits>>i & 1) for i in xrange(self._n))
+
+    def mark_range(self, start, end):
+        '''Marks tokens start through end (inclusive) as accounted for.'''
+        last = min(end, self._n-1)
+        if start<=last:
+            self._bits |= ((1<<(last-start+1))-1)<<start
+        if end>last:
+            self._index(end)    # out of range
+
+class EdgeFlags(object):
+    '''
+    One flag per (head, dependent) edge, indexed like a dict from edges to bools.
+    Edges not in the parse can be added by assigning to them.
+    >>> e = EdgeFlags([(None, 0), (0, 1), (3, 1), (1, 2), (1, 3)])
+    >>> e[(0, 1)] = True
+    >>> e.mark_span(1, 2)
+    >>> [x for x in e.remaining()], (2, 0) in e
+    ([(None, 0), (3, 1), (1, 3)], False)
+    >>> e[(2, 0)]
+    Traceback (most recent call last):
+      ...
+    KeyError: (2, 0)
+    >>> e[(2, 0)] = True
+    >>> e[(2, 0)], len(e)
+    (True, 6)
+    '''
+    __slots__ = ('_ids', '_edges', '_starts', '_nParsed', '_bits')
+
+    def __init__(self, edges=()):
+        self._ids = {}      # edge -> id
+        self._edges = []    # id -> edge
+        self._starts = []   # first id of an edge with each dependent (for edges in order of dependents)
+        for edge in edges:
+            if edge not in self._ids:
+                self._add(edge)
+                while len(self._starts)<=edge[1]:
+                    self._starts.append(len(self._edges)-1)
+        self._nParsed = len(self._edges)
+        self._bits = 0
+
+    def _add(self, edge):
+        i = self._ids[edge] = len(self._edges)
+        self._edges.append(edge)
+        return i
+
+    def __getitem__(self, edge):
+        return bool(self._bits>>self._ids[edge] & 1)
+
+    def __setitem__(self, edge, v):
+        i = self._ids.get(edge)
+        if i is None:
+            i = self._add(edge)
+        if v:
+            self._bits |= 1<<i
+        else:
+            self._bits &= ~(1<<i)
+
+    def __contains__(self, edge):
+        return edge in self._ids
+
+    def __len__(self):
+        return len(self._edges)
+
+    def __iter__(self):
+        return iter(self._edges)
+
+    def mark_span(self, start, end):
+        '''Marks all edges with both the head and the dependent in tokens start through end (inclusive).'''
+        starts = self._starts
+        first = starts[start] if start<len(starts) else self._nParsed
+        last = starts[end+1] if end+1<len(starts) else self._nParsed
+        bits = 0
+        for i in xrange(first, last):
+            h = self._edges[i][0]
+            if h is not None and start<=h<=end:
+                bits |= 1<<i
+        for i in xrange(self._nParsed, len(self._edges)):   # edges added since
+            h, d = self._edges[i]
+            if h is not None and d is not None and start<=h<=end and start<=d<=end:
+                bits |= 1<<i
+        self._bits |= bits
+
+    def remaining(self):
+        '''Edges not yet accounted for, in order of their ids.'''
+        bits = self._bits
+        return (edge for i,edge in enumerate(self._edges) if not bits>>i & 1)
+
+class Completed(tuple):
+    '''
+    The (tokens, edges) flags of a sentence.
+    >>> c = Completed.from_dep_parse([[{'gov_idx': None, 'dep_idx': 0}], None, [{'gov_idx': 0, 'dep_idx': 2}]])
+    >>> c[0][1], c[1][(0, 2)], list(c[1].remaining())
+    (False, False, [(None, 0), (0, 2)])
+    '''
+    @classmethod
+    def from_dep_parse(cls, depParse):
+        return cls((TokenFlags(len(depParse)),
+                    EdgeFlags((dep['gov_idx'],m) for m in range(len(depParse)) if depParse[m] for dep in depParse[m])))
+
+if __name__=='__main__':
+    import doctest
+    doctest.testmod()
@@ -18,8 +18,62 @@ fullNombank = False
 alignments = False
 '''Include AMR triple-to-token alignments in the output'''
 
+rejectCycles = False
+'''If True, adding an AMR edge that would close a cycle raises an error (failing the 
+pipeline step) instead of only producing a warning'''
+
 errorTolerant = False
 '''If True, any exception encountered for an input sentence will be displayed 
 and execution will proceed the next sentence. Otherwise, all exceptions are fatal.'''
 
 showSentence = True
+
+nProcesses = 1
+'''Number of worker processes for sentence-parallel execution. 
+Output is emitted in the same order as with a single process.'''
+
+timingReport = None
+'''If set, path of a report (JSON, or CSV if the name ends in .csv) with wall-clock 
+and CPU time per pipeline step, percentiles, and the slowest sentences'''
+
+profileDir = None
+'''If set, directory to which a cProfile dump is written for each pipeline step'''
+
+cacheDir = None
+'''If set, directory of a result cache: sentences whose input JSON, output-relevant 
+settings, and pipeline code are unchanged since a previous run are not recomputed; 
+their stored output is replayed instead'''
+
+cacheSize = None
+'''If set, maximum size of the result cache in megabytes; least recently used 
+entries are evicted at the end of a run'''
+
+sentenceTimeLimit = None
+'''If set (and in error-tolerant mode), number of seconds after which processing 
+of a sentence is abandoned: its AMR is output as (x1 / amr-empty) 
+and the reason is reported on stderr as JSON'''
+
+stageTimeLimit = None
+'''Like sentenceTimeLimit, but for each pipeline step of a sentence'''
+
+memoryLimit = None
+'''If set (and in error-tolerant mode), growth of resident memory in megabytes since the 
+start of a sentence above which its processing is abandoned, as for sentenceTimeLimit'''
+
+stageMemoryLimit = None
+'''Like memoryLimit, but for the growth since the start of each pipeline step of a sentence'''
+
+stages = None
+'''Names of the pipeline steps to run, in order (default: all). 
+@see: stages.select()'''
+
+outputFile = None
+'''If set, file to which the AMRs are written (block-buffered, gzip-compressed 
+if the name ends in .gz) rather than printed to stdout; '-' for stdout'''
+
+outputFormat = None
+'''Format of outputFile: 'penman' (as printed to stdout) or 'jsonl' 
+(sentence ID, AMR, triples, alignments, timing). By default, jsonl if the file name contains .jsonl'''
+
+progressInterval = 1.0
+'''Minimum number of seconds between progress reports on stderr (0 to report every sentence)'''
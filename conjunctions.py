@@ -9,9 +9,9 @@ from __future__ import print_function
 import os, sys, re, codecs, fileinput
 
 import pipeline
-from pipeline import new_amr_from_old, get_or_create_concept_from_token as amrget
+from pipeline import update_amr, get_or_create_concept_from_token as amrget
 
-def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, completed):
+def main(sentenceId, sentence, tokens, ww, wTags, depParse, inAMR, alignment, completed):
     amr = inAMR
     nConjOps = {}   # maps conjunction concept variable to its current number of :opX relations
     for deps in depParse:
@@ -26,7 +26,7 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
                 newtriple = (str(x), 'op'+str(nConjOps.setdefault(x,0)+1), str(y))
                 nConjOps[x] += 1
 
-                amr = new_amr_from_old(amr, new_triples=[newtriple])
+                update_amr(amr, new_triples=[newtriple])
 
                 completed[1][(c,i)] = True
 
@@ -8,24 +8,32 @@ from __future__ import print_function
 import os, sys, re, codecs, fileinput
 
 import pipeline, config
-from pipeline import new_concept, new_amr_from_old, loadCoref, choose_head
+from pipeline import new_concept, update_amr, loadCoref
 
-def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, completed):
+def main(sentenceId, sentence, tokens, ww, wTags, depParse, inAMR, alignment, completed):
     amr = inAMR
     
-    coref = loadCoref(jsonFile, ww)
+    coref = loadCoref(sentence, ww)
     
     #print(coref)
     
+    # variables linked by the relations checked below, in either direction; kept up to date as links are added
+    neighbors = {'-COREF': {}, 'domain': {}}
+    for x,r,(y,) in amr.triples(instances=False):
+        if r in neighbors:
+            add_symmetric_link(neighbors[r], x, y)
+    
+    def preference(mention):
+        # preferences: pronouns (-FALLBACK_PRON) < hallucinated concepts (-FALLBACK) < content words from the sentence
+        x = alignment[:mention[1]]
+        concept = None if x is None else amr.node_to_concepts[str(x)]
+        return (x is None or '-FALLBACK_PRON' not in concept, x is None or '-FALLBACK' not in concept, mention[1]-mention[0])
+    
     for cluster in coref.values():
         clusterX = None # choose one member of the cluster to decorate with coreferent equivalents, marked :-COREF
-        for i,j,w in sorted(cluster, key=lambda mention: (alignment[:mention[1]] is None or '-FALLBACK_PRON' not in amr.node_to_concepts[str(alignment[:mention[1]])],
-                                                          alignment[:mention[1]] is None or '-FALLBACK' not in amr.node_to_concepts[str(alignment[:mention[1]])],
-                                                          mention[1]-mention[0]), reverse=True):
-            # preferences: pronouns (-FALLBACK_PRON) < hallucinated concepts (-FALLBACK) < content words from the sentence
+        for i,j,w in sorted(cluster, key=preference, reverse=True):
             assert ' '.join(filter(None, ww[i:j+1]))==w,(w,i,j, ww[i:j+1])
-            trips = amr.triples(instances=False)
-            h = choose_head(range(i,j+1), depParse)
+            h = sentence.index.choose_head(i, j)
             x = alignment[:h] # index of variable associated with the head, if any
             if not (x or x==0): # need a new variable
                 print('TODO: coreferring mention not yet in AMR')
@@ -37,9 +45,10 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
             else:
                 isCopula = False
                 # note that previous modules have inserted some :-COREF links for equivalent nodes
-                for x2 in [str(clusterX)]+symmetric_neighbors(str(clusterX), '-COREF', amr):
-                    for x3 in [str(x)]+symmetric_neighbors(str(x), '-COREF', amr):
-                        if x3 in symmetric_neighbors(x2, 'domain', amr):
+                coref_links, domain_links = neighbors['-COREF'], neighbors['domain']
+                for x2 in [str(clusterX)]+coref_links.get(str(clusterX), []):
+                    for x3 in [str(x)]+coref_links.get(str(x), []):
+                        if x3 in domain_links.get(x2, ()):
                             isCopula = True
                             if config.verbose: print('blocked coreference link (probably a copula cxn) between variables:',x,clusterX, file=sys.stderr)
                             break
@@ -50,10 +59,18 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
 
                 newtriple = (str(clusterX), '-COREF', str(x))
                 
-                amr = new_amr_from_old(amr, new_triples=[newtriple])
+                update_amr(amr, new_triples=[newtriple])
+                add_symmetric_link(coref_links, *newtriple[::2])
 
     return depParse, amr, alignment, completed
 
+def add_symmetric_link(links, x, y):
+    '''Records an edge between variables 'x' and 'y' in 'links', which maps each variable to the 
+    variables linked to it by edges of one type in either direction (cf. symmetric_neighbors()).'''
+    links.setdefault(x, []).append(y)
+    if y!=x:
+        links.setdefault(y, []).append(x)
+
 def symmetric_neighbors(v, link, amr):
     '''Returns variables of all neighboring nodes to 'v' linked to it by an edge of type 'link' in either direction.'''
     return [(x if y==v else y) for x,r,(y,) in amr.triples(instances=False) if v in [x,y] and r==link]
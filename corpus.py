@@ -0,0 +1,165 @@
+#!/usr/bin/env python2.7
+'''
+Input side of the pipeline: reads preprocessed sentences as a stream of
+SentenceRecords, from per-sentence JSON files (wsj_XXXX.N.json), from JSONL
+shards (optionally gzip-compressed), or from tar archives of per-sentence files.
+
+A shard line is the sentence JSON with an extra "id" field (the sentence ID)
+written first, e.g. {"id": "wsj_0001.0", "bbn_ne": ..., ...}.
+
+Run as a script to convert per-sentence files into shards:
+
+    python corpus.py [-z] [-n SENTENCES_PER_SHARD] OUTPREFIX examples/*.json
+
+writes OUTPREFIX.00000.jsonl(.gz), OUTPREFIX.00001.jsonl(.gz), ...
+
+@see: pipeline.py
+'''
+from __future__ import print_function
+import os, sys, re, codecs, json
+
+from collections import OrderedDict
+
+def wsj_sort(path):
+    m = re.search(r'wsj_(\d{4})\.(\d+)', path)
+    if not m: return 0
+    docnum, sentnum = m.groups()
+    return (int(docnum), int(sentnum))
+
+class SentenceRecord(object):
+    '''
+    A sentence from the preprocessed corpus. The sentence JSON is decoded once
+    (on first access) and then shared by all pipeline steps, which read their
+    slices of it through the properties below or the load*() functions.
+
+    Until it is decoded, a record only holds the sentence ID and either the file path
+    or the undecoded JSON text, so it is cheap to pass to worker processes.
+    '''
+    def __init__(self, sentenceId, path=None, data=None, text=None):
+        self.sentenceId = sentenceId
+        self.path = path
+        self._data = data
+        self._text = text
+        self.index = None
+        '''SentenceIndex over the dependency parse while the sentence is being processed'''
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(os.path.basename(path).replace('.json',''), path=path)
+
+    @property
+    def data(self):
+        '''The decoded sentence JSON'''
+        if self._data is None:
+            if self._text is not None:
+                self._data = json.loads(self._text)
+                self._text = None
+            else:
+                with codecs.open(self.path, 'r', 'utf-8') as jsonF:
+                    self._data = json.load(jsonF)
+        return self._data
+
+    @property
+    def bbn_ne(self):
+        return self.data['bbn_ne']
+
+    @property
+    def timex(self):
+        return self.data['timex']
+
+    @property
+    def prop(self):
+        return self.data['prop']
+
+    @property
+    def nom(self):
+        return self.data['nom']
+
+    @property
+    def coref_chains(self):
+        return self.data['coref_chains']
+
+def is_shard(path):
+    return path.endswith(('.jsonl', '.jsonl.gz'))
+
+def is_archive(path):
+    return path.endswith(('.tar', '.tar.gz', '.tgz'))
+
+def iter_sentences(paths):
+    '''
+    Generates a SentenceRecord for each sentence in the given input files.
+    Per-sentence JSON files come first, in document/sentence order;
+    then the contents of shards and archives, in the order given.
+    '''
+    for path in sorted((p for p in paths if not is_shard(p) and not is_archive(p)), key=wsj_sort):
+        yield SentenceRecord.from_file(path)
+    for path in paths:
+        if is_shard(path):
+            for record in iter_shard(path):
+                yield record
+        elif is_archive(path):
+            for record in iter_archive(path):
+                yield record
+
+_ID_PREFIX = re.compile(r'\{\s*"id"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+def record_from_line(line):
+    '''Makes a SentenceRecord from a shard line, leaving the JSON undecoded
+    (apart from the leading ID field) until a pipeline step needs it.'''
+    m = _ID_PREFIX.match(line)
+    if m:
+        return SentenceRecord(json.loads(m.group(1)), text=line)
+    data = json.loads(line)     # ID field not first: decode the whole line
+    return SentenceRecord(data['id'], data=data)
+
+def iter_shard(path):
+    '''Generates the records of a JSONL shard.'''
+    import gzip
+    with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as inF:
+        for line in inF:
+            if line.strip():
+                yield record_from_line(line)
+
+def iter_archive(path):
+    '''Generates the records of a tar archive of per-sentence JSON files, in archive order.
+    The archive is read as a stream, so it may be compressed.'''
+    import tarfile
+    tarF = tarfile.open(path, 'r|*')
+    try:
+        for member in tarF:
+            if member.isfile() and member.name.endswith('.json'):
+                yield SentenceRecord(os.path.basename(member.name).replace('.json',''),
+                                     text=tarF.extractfile(member).read())
+    finally:
+        tarF.close()
+
+def write_shards(paths, outprefix, shardSize=10000, compress=False):
+    '''Converts per-sentence JSON files into JSONL shards of up to 'shardSize' sentences each.
+    @return: list of the shard files written'''
+    import gzip
+    shards = []
+    outF = None
+    for i,path in enumerate(sorted(paths, key=wsj_sort)):
+        if i%shardSize==0:
+            if outF: outF.close()
+            shards.append('{}.{:05d}.jsonl{}'.format(outprefix, len(shards), '.gz' if compress else ''))
+            outF = gzip.open(shards[-1], 'wb') if compress else open(shards[-1], 'wb')
+        with codecs.open(path, 'r', 'utf-8') as jsonF:
+            data = json.load(jsonF, object_pairs_hook=OrderedDict)
+        record = OrderedDict([('id', SentenceRecord.from_file(path).sentenceId)])
+        record.update(data)
+        outF.write(json.dumps(record)+'\n')
+    if outF: outF.close()
+    return shards
+
+if __name__=='__main__':
+    import argparse, glob
+    parser = argparse.ArgumentParser(description='Convert per-sentence JSON files into JSONL shards.')
+    parser.add_argument('-n', type=int, default=10000, help="sentences per shard")
+    parser.add_argument('-z', action='store_true', help="gzip-compress the shards")
+    parser.add_argument('outprefix', help="output path prefix")
+    parser.add_argument('files', nargs='+', help="per-sentence JSON files")
+    args = parser.parse_args(sys.argv[1:])
+
+    for shard in write_shards([f for ff in args.files for f in glob.glob(ff)], args.outprefix, args.n, args.z):
+        print(shard, file=sys.stderr)
@@ -6,12 +6,10 @@ Abstract Meaning Representation
 @since: 2012-06-18
 '''
 
-from dag import Dag
+from dag import Dag, run_steps
 from amr_parser import make_amr_parser, SpecialValue, StrLiteral
 
 from collections import defaultdict
-import pyparsing
-import unittest
 import re
 import sys
 import copy
@@ -59,7 +57,6 @@ class Amr(Dag):
 
     def __init__(self, *args, **kwargs):       
         super(Amr, self).__init__(*args, **kwargs)
-        self.__cached_triples = None
         self.node_to_concepts = {}
 
     def apply_node_map(self, node_map):
@@ -69,7 +66,6 @@ class Amr(Dag):
         new = Dag.apply_node_map(self, node_map)
         new.__class__ = Amr
         new.node_to_concepts = {}
-        new.__cached_triples = None
         for n in self.node_to_concepts:
             if n in node_map:
                 new.node_to_concepts[node_map[n]] = self.node_to_concepts[n]
@@ -82,6 +78,7 @@ class Amr(Dag):
         """
         Initialize a new abstract meaning representation from a Pennman style string.
         """
+        import pyparsing
         if not cls._parser_singleton: # Initialize the AMR parser only once
             _parser_singleton = make_amr_parser()           
         try:
@@ -182,6 +179,8 @@ class Amr(Dag):
         Flip edges in the AMR so that all nodes are reachable from the unique root.
         If 'swap_callback' is provided, it is called whenever an edge is inverted with 
         two arguments: the old triple and the new triple. 
+        Nodes that cannot be reached even by inverting edges (i.e., in another weakly 
+        connected component) are left unreachable from the root.
         >>> x =Amr.from_triples( [(u'j', u'ARG0', (u'p',)), (u'j', u'ARG1', (u'b',)), (u'j', u'ARGM-PRD', ('t',)), (u'j', 'time', ('d',)), (u'p', 'age', ('t1',)), (u'p', 'name', ('n',)), ('t', u'ARG0-of', ('d1',)), ('d', 'day', (29,)), ('d', 'month', (11,)), ('t1', 'quant', (61,)), ('t1', 'unit', ('y',)), ('n', 'op1', (u'"Pierre"',)), ('n', 'op2', (u'"Vinken"',)), ('d1', u'ARG0', ('t',)), ('d1', u'ARG3', (u'n1',))] , {u'b': u'board', 'd': 'date-entity', u'j': u'join-01-ROOT', 't1': 'temporal-quantity', u'p': u'person', 't': 'thing', 'y': 'year', u'n1': u'nonexecutive', 'n': 'name', 'd1': 'direct-01'} )
         >>> x
         DAG{ (j / join-01-ROOT :ARG0 (p / person :age (t1 / temporal-quantity :quant 61 :unit (y / year) ) :name (n / name :op1 "Pierre" :op2 "Vinken")) :ARG1 (b / board) :ARGM-PRD (t / thing :ARG0-of (d1 / direct-01 :ARG0 t :ARG3 (n1 / nonexecutive) )) :time (d / date-entity :day 29 :month 11)) }
@@ -192,24 +191,39 @@ class Amr(Dag):
             raise ValueError, "%s is not a node in this AMR." % root    
         amr = self.clone(warn=warn)
 
-        all_nodes = set(amr.get_nodes())
-
-        unreached  = True
-        while unreached: 
-            reach_triples = amr.triples(start_node = root, instances = False)
-            reached = set()
-            reached.add(root)
-            for p,r,c in reach_triples: 
-                reached.add(p)
-                reached.update(c)
-
-            unreached = all_nodes - reached
-     
-            out_triples = [(p,r,c) for p,r,c in amr.triples(refresh = True, instances = False) if c[0] in reached and p in unreached]
-            for p,r,c in out_triples:
+        # Edges are inverted in rounds: each round inverts the edges (in the order of the 
+        # breadth-first triple listing) from unreached parents into the nodes reached so far
+        # (an undirected breadth-first search from the root). A parent's own edges are unchanged 
+        # until it is reached, so one listing of the original edges gives the order of every round.
+        listing = amr.triples(instances = False)
+        into = defaultdict(list)    # node -> indices in listing of the edges into it
+        for i,(p,r,c) in enumerate(listing):
+            into[c[0]].append(i)
+
+        reached = set()
+        def reach(nodes):   # extends 'reached' along the current edges, returns the newly reached nodes
+            queue = []
+            for n in nodes:
+                if n not in reached:
+                    reached.add(n)
+                    queue.append(n)
+            for n in queue:
+                for c in amr[n].values():
+                    for x in c:
+                        if x not in reached:
+                            reached.add(x)
+                            queue.append(x)
+            return queue
+
+        frontier = reach([root])
+        while frontier:
+            out_triples = sorted(i for n in frontier for i in into[n] if listing[i][0] not in reached)
+            for i in out_triples:
+                p,r,c = listing[i]
                 newtrip = (c[0],"%s-of" %r, (p,))
                 amr._replace_triple(p,r,c,*newtrip, warn=warn)
                 if swap_callback: swap_callback((p,r,c),newtrip)
+            frontier = reach([listing[i][0] for i in out_triples])
         amr.triples(refresh = True)            
         amr.roots = [root]
         amr.node_alignments = self.node_alignments
@@ -244,15 +258,14 @@ class Amr(Dag):
         return new_amr    
 
     @classmethod
-    def from_triples(cls, triples, concepts, roots=None, warn=sys.stderr):
+    def from_triples(cls, triples, concepts, roots=None, warn=sys.stderr, reject_cycles=False):
         """
         Initialize a new abstract meaning representation from a collection of triples 
         and a node to concept map.
         """
-        amr = Dag.from_triples(triples, roots, warn=warn)
+        amr = Dag.from_triples(triples, roots, warn=warn, reject_cycles=reject_cycles)
         amr.__class__ = Amr
         amr.node_to_concepts = concepts
-        amr.__cached_triples = None
         return amr
 
     def get_concept(self, node):
@@ -261,6 +274,18 @@ class Amr(Dag):
         """
         return self.node_to_concepts[node]
     
+    def _node_label(self, node):
+        """
+        Concepts, and the values of nodes without a concept, are kept in the canonical form.
+        >>> Amr.from_triples([('a', 'B', 'c')], {'a': 'x', 'c': 'y'}) == Amr.from_triples([('d', 'B', 'e')], {'d': 'x', 'e': 'y'})
+        True
+        >>> Amr.from_triples([('a', 'B', 'c')], {'a': 'x', 'c': 'y'}) == Amr.from_triples([('d', 'B', 'e')], {'d': 'x', 'e': 'z'})
+        False
+        """
+        if node in self.node_to_concepts:
+            return "/ %s" % (self.node_to_concepts[node],)
+        return node
+
     def _set_concept(self, node, concept):
         """
         Set concept name for a node.
@@ -270,21 +295,13 @@ class Amr(Dag):
     def triples(self, instances = True, start_node = None, refresh = False):
         """
         Retrieve a list of (node, role, filler) triples. If instances is False
-        do not include 'instance' roles.
+        do not include 'instance' roles. In that case the list is the one 
+        cached by Dag.triples(), which must not be modified.
         """
-
+        res = super(Amr, self).triples(start_node, refresh)
         if not instances: 
-            return super(Amr, self).triples(start_node, refresh)
-        else: 
-            if (not (refresh or start_node)) and self.__cached_triples:
-                return self.__cached_triples
-            
-            res = copy.copy(super(Amr, self).triples(start_node, refresh))
-            if instances:
-                for node, concept in self.node_to_concepts.items():
-                    res.append((node, 'instance', concept))
-            self.__cached_triples = res                        
             return res
+        return res + [(node, 'instance', concept) for node, concept in self.node_to_concepts.items()]
 
     def __str__(self):
         def extractor(node, firsthit, leaf):
@@ -435,7 +452,6 @@ class Amr(Dag):
         new = Dag.apply_node_map(self, node_map, *args, **kwargs)    
         new.__class__ = Amr
         new.node_to_concepts = {} 
-        new.__cached_triples = None
         for node in self.node_to_concepts:
             if node in node_map:
                 new.node_to_concepts[node_map[node]] = self.node_to_concepts[node]
@@ -454,7 +470,7 @@ def ast_to_amr(ast):
     """
     dag = Amr()
 
-    def rec_step(x):  # Closure over dag
+    def rec_step(x):  # Closure over dag; yields the children to convert (see run_steps())
 
         node, concept, roles = x         
 
@@ -487,7 +503,7 @@ def ast_to_amr(ast):
                     if aligned:
                         dag.edge_alignments[(node, role, tuple_child)] = aligned
                     x = dag[childnode]
-                    rec_step(child)
+                    yield child
 
                 elif type(child) == list: #Hyperedge 
                     childnode = set()
@@ -499,7 +515,7 @@ def ast_to_amr(ast):
                             else: 
                                 new_c = c[0]
                             childnode.add(new_c)
-                            rec_step(c)
+                            yield c
                         else:
                             if type(c) is str and c.startswith("@"):
                                 c = c.replace("@","")
@@ -526,7 +542,7 @@ def ast_to_amr(ast):
     root = ast[0]
     if type(root) == tuple and len(root) == 3: 
         dag.roots.append(root[0])
-        rec_step(root)
+        run_steps(rec_step, root)
     else: 
         dag.roots.append(root)
 
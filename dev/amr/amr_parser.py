@@ -5,10 +5,7 @@ Parse a feature-structure-style text encoding of an AMR.
 @since: 2012-06-18
 '''
 
-from pyparsing import Literal,Word,CharsNotIn, OneOrMore, ZeroOrMore,Forward,nums,alphas, Optional, ParserElement 
 from collections import defaultdict
-import pyparsing
-import unittest
 import re
 import sys
 import copy
@@ -31,6 +28,9 @@ def make_amr_parser():
     Pyparsing parser for AMRs. This will return an abstract syntax tree that
     needs to be converted into an AMR using ast_to_amr.
     """
+    # pyparsing is only imported when a parser is needed
+    from pyparsing import Literal,Word,CharsNotIn, OneOrMore, ZeroOrMore,Forward,nums,alphas, Optional, ParserElement 
+
     def debug(s, loc, tok):
         if len(tok) > 1:
             flat = [tok[0]] + tok[1:]
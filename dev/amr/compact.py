@@ -0,0 +1,418 @@
+'''
+Compact, read-only storage for large numbers of DAGs and AMRs.
+
+Node identifiers, relations, and concepts are interned to integers in a SymbolTable
+(by default, one shared by all compact graphs), and the edges are held in array('i')
+columns in compressed sparse row layout: the outgoing edges of the i-th node are
+those from offsets[i] to offsets[i+1], each with a relation and a run of child nodes.
+The incoming edges are indexed the same way, and nodes are looked up by binary search
+in a sorted copy of their symbols.
+
+The query methods (triples(), roots, get_nodes(), out_edges(), in_edges(),
+node_to_concepts, ...) return the same as those of the Dag or Amr the compact graph
+was made from, so smatch and evaluation code can use either. to_dag()/to_amr() rebuild
+a full Dag or Amr, e.g. to modify it.
+
+@see: dag.Dag, amr.Amr
+'''
+
+from array import array
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+from collections import deque
+
+from dag import Dag
+from amr import Amr
+
+class SymbolTable(object):
+    """
+    Interns hashable values (node identifiers, relations, concepts) to consecutive integers.
+    Values of different types are kept apart even if they compare equal.
+    >>> s = SymbolTable()
+    >>> s.intern('a'), s.intern('b'), s.intern('a'), s.intern(u'a')
+    (0, 1, 0, 2)
+    >>> s[1], s.get(u'a'), s.get('c')
+    ('b', 2, None)
+    """
+    __slots__ = ('ids', 'symbols')
+
+    def __init__(self):
+        self.ids = {}
+        self.symbols = []
+
+    def intern(self, x):
+        key = (type(x), x)
+        i = self.ids.get(key)
+        if i is None:
+            i = self.ids[key] = len(self.symbols)
+            self.symbols.append(x)
+        return i
+
+    def get(self, x):
+        """
+        The integer for 'x', or None if it has not been interned.
+        """
+        return self.ids.get((type(x), x))
+
+    def __getitem__(self, i):
+        return self.symbols[i]
+
+    def __len__(self):
+        return len(self.symbols)
+
+SYMBOLS = SymbolTable()
+'''Symbol table shared by compact graphs unless another is given'''
+
+class OutEdges(list):
+    """
+    The outgoing edges of a node, as (relation, child) pairs in the order of ListMap.items().
+    """
+    def items(self):
+        return list(self)
+
+class CompactDag(object):
+    """
+    A read-only DAG stored in integer arrays.
+    >>> x = Dag.from_triples([('a', 'B', 'c'), ('a', 'A', 'd'), ('c', 'E', ('f', 'g')), ('d', 'H', 'c')])
+    >>> y = CompactDag.from_dag(x)
+    >>> y.triples() == x.triples(), y.roots == x.roots, y.get_nodes() == x.get_nodes()
+    (True, True, True)
+    >>> y.out_edges('c'), y.in_edges('c'), y.in_edges('a'), 'x' in y
+    ([('c', 'E', ('f', 'g'))], [('a', 'B', ('c',)), ('d', 'H', ('c',))], [], False)
+    >>> y.to_dag() == x
+    True
+    """
+    __slots__ = ('symbols', '_nodes', '_offsets', '_rels', '_child_offsets', '_children', '_roots', '_external',
+                 '_sorted_nodes', '_sorted_index', '_in_offsets', '_in_edges')
+
+    def __init__(self, symbols=SYMBOLS):
+        self.symbols = symbols
+        self._nodes = array('i')          # symbol of each node, in the order of the DAG's keys
+        self._offsets = array('i', [0])   # edges of node i: offsets[i] to offsets[i+1]
+        self._rels = array('i')           # symbol of the relation of each edge
+        self._child_offsets = array('i', [0])   # children of edge j: child_offsets[j] to child_offsets[j+1]
+        self._children = array('i')       # node index of each child
+        self._roots = array('i')          # node index of each root
+        self._external = array('i')       # node index of each external node
+        self._sorted_nodes = array('i')   # node symbols in ascending order,
+        self._sorted_index = array('i')   # and the node index of each
+        self._in_offsets = array('i', [0])  # incoming edges of node i: in_offsets[i] to in_offsets[i+1]
+        self._in_edges = array('i')       # edge index of each incoming edge
+
+    @classmethod
+    def from_dag(cls, dag, symbols=SYMBOLS):
+        """
+        Initialize a compact copy of 'dag'.
+        """
+        res = cls(symbols)
+        index = {}  # node symbol -> node index
+        def node_index(n):
+            n = symbols.intern(n)
+            i = index.get(n)
+            if i is None:
+                i = index[n] = len(res._nodes)
+                res._nodes.append(n)
+            return i
+        for n in dag:
+            node_index(n)
+        for n in list(res._nodes):
+            for rel, child in dict.__getitem__(dag, symbols[n]).items():
+                res._rels.append(symbols.intern(rel))
+                for c in (child if type(child) is tuple else (child,)):
+                    res._children.append(node_index(c))
+                res._child_offsets.append(len(res._children))
+            res._offsets.append(len(res._rels))
+        for n in dag.roots:
+            res._roots.append(node_index(n))
+        for n in dag.external_nodes:
+            res._external.append(node_index(n))
+        while len(res._offsets) <= len(res._nodes):   # nodes only found as children or roots have no edges
+            res._offsets.append(len(res._rels))
+        res._index_nodes()
+        return res
+
+    def _index_nodes(self):
+        """
+        Build the sorted node symbols and the incoming edges from the nodes and outgoing edges.
+        """
+        nodes = self._nodes
+        positions = sorted(xrange(len(nodes)), key=nodes.__getitem__)
+        self._sorted_nodes = array('i', (nodes[i] for i in positions))
+        self._sorted_index = array('i', positions)
+        incoming = [[] for n in nodes]
+        children, child_offsets = self._children, self._child_offsets
+        for j in xrange(len(self._rels)):
+            for c in children[child_offsets[j]:child_offsets[j+1]]:
+                if not incoming[c] or incoming[c][-1] != j:
+                    incoming[c].append(j)
+        self._in_offsets = array('i', [0])
+        self._in_edges = array('i')
+        for edges in incoming:
+            self._in_edges.extend(edges)
+            self._in_offsets.append(len(self._in_edges))
+
+    def _fill(self, dag):
+        """
+        Copy the nodes, edges, roots, and external nodes into the empty 'dag'.
+        """
+        symbols = self.symbols
+        nodes = [symbols[n] for n in self._nodes]
+        for n in nodes:
+            dag[n]
+        for i, n in enumerate(nodes):
+            for rel, child in self._edges(i):
+                dag[n].append(symbols[rel], tuple(nodes[c] for c in child))
+        dag.roots = [nodes[r] for r in self._roots]
+        dag.external_nodes = [nodes[n] for n in self._external]
+        return dag
+
+    def to_dag(self):
+        """
+        Return a (modifiable) Dag with the same nodes, edges, and roots.
+        """
+        return self._fill(Dag())
+
+    def _edges(self, i):
+        """
+        The outgoing edges of the i-th node, as (relation symbol, child node indices) pairs.
+        """
+        children, child_offsets = self._children, self._child_offsets
+        return [(self._rels[j], children[child_offsets[j]:child_offsets[j+1]])
+                for j in xrange(self._offsets[i], self._offsets[i+1])]
+
+    def _index(self, node):
+        """
+        The index of 'node', or None if it is not in the DAG.
+        """
+        n = self.symbols.get(node)
+        if n is None:
+            return None
+        k = bisect_left(self._sorted_nodes, n)
+        if k < len(self._sorted_nodes) and self._sorted_nodes[k] == n:
+            return self._sorted_index[k]
+        return None
+
+    def _triple(self, i, rel, child):
+        symbols, nodes = self.symbols, self._nodes
+        return (symbols[nodes[i]], symbols[rel], tuple(symbols[nodes[c]] for c in child))
+
+    def __getitem__(self, node):
+        """
+        The outgoing edges of 'node' (none if it is not in the DAG).
+        """
+        i = self._index(node)
+        if i is None:
+            return OutEdges()
+        symbols, nodes = self.symbols, self._nodes
+        return OutEdges((symbols[rel], tuple(symbols[nodes[c]] for c in child)) for rel, child in self._edges(i))
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        return (self.symbols[n] for n in self._nodes)
+
+    def __contains__(self, node):
+        return self._index(node) is not None
+
+    @property
+    def roots(self):
+        return [self.symbols[self._nodes[r]] for r in self._roots]
+
+    @property
+    def external_nodes(self):
+        return [self.symbols[self._nodes[n]] for n in self._external]
+
+    def triples(self, start_node = None, **kwargs):
+        """
+        Traverse the DAG breadth first to collect a list of (parent, relation, child) triples,
+        in the same order as Dag.triples().
+        """
+        symbols = self.symbols
+        if start_node:
+            start = self._index(start_node)
+            queue = deque([start] if start is not None else [])
+        else:
+            queue = deque(self._roots)
+        triples = []
+        tabu = set()
+        while queue:
+            i = queue.popleft()
+            if i not in tabu:
+                tabu.add(i)
+                edges = [(symbols[rel], rel, child) for rel, child in self._edges(i)]
+                for relsym, rel, child in sorted(edges, key=itemgetter(0)):
+                    triples.append(self._triple(i, rel, child))
+                    queue.extend(c for c in child if c not in tabu)
+        return triples
+
+    def get_ordered_nodes(self):
+        """
+        Map the nodes to integers in the order in which they first occur in triples().
+        """
+        order = {}
+        for par, rel, child in CompactDag.triples(self):
+            for n in (par,)+child:
+                if n not in order:
+                    order[n] = len(order)
+        return order
+
+    def get_nodes(self):
+        """
+        Return the list of node identifiers, in the order of get_ordered_nodes().
+        """
+        order = self.get_ordered_nodes()
+        return sorted(order, key=order.get)
+
+    def out_edges(self, node):
+        """
+        Return outgoing edges from this node.
+        """
+        i = self._index(node)
+        assert i is not None
+        return [self._triple(i, rel, child) for rel, child in self._edges(i)]
+
+    def in_edges(self, node):
+        """
+        Return incoming edges for a single node.
+        """
+        target = self._index(node)
+        if target is None:
+            return []
+        children, child_offsets = self._children, self._child_offsets
+        res = []
+        for j in self._in_edges[self._in_offsets[target]:self._in_offsets[target+1]]:
+            i = bisect_right(self._offsets, j) - 1  # the node whose edges include edge j
+            res.append(self._triple(i, self._rels[j], children[child_offsets[j]:child_offsets[j+1]]))
+        return res
+
+    def has_edge(self, par, rel, child):
+        return par in self and (par, rel, child) in self.out_edges(par)
+
+    def __eq__(self, other):
+        return self.to_dag() == (other.to_dag() if isinstance(other, CompactDag) else other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.to_dag())
+
+    # printed by the traversal of Dag, which only needs the outgoing edges of each node
+    # (to_dag() does not keep their order in all cases)
+    dfs = Dag.dfs.__func__
+
+    def to_string(self, newline = True):
+        return Dag.to_string.__func__(_Printed(self), newline)
+
+    __str__ = Dag.__str__.__func__
+
+class CompactAmr(CompactDag):
+    """
+    A read-only AMR stored in integer arrays.
+    >>> x = Amr.from_string("(j / join-01 :ARG0 (p / person :name (n / name :op1 \\"Pierre\\")) :ARG1 (b / board))")
+    >>> y = CompactAmr.from_amr(x)
+    >>> y.triples() == x.triples(), y.node_to_concepts == x.node_to_concepts
+    (True, True)
+    >>> str(y) == str(x), y.get_concept('p')
+    (True, 'person')
+    """
+    __slots__ = ('_concept_nodes', '_concepts', '_node_concepts')
+
+    def __init__(self, symbols=SYMBOLS):
+        CompactDag.__init__(self, symbols)
+        self._concept_nodes = array('i')  # node index and concept symbol of each entry of node_to_concepts,
+        self._concepts = array('i')       # in its iteration order
+        self._node_concepts = array('i')  # concept symbol of each node (-1 for none)
+
+    @classmethod
+    def from_amr(cls, amr, symbols=SYMBOLS):
+        """
+        Initialize a compact copy of 'amr'.
+        """
+        res = cls.from_dag(amr, symbols)
+        nNodes = len(res._nodes)
+        for node, concept in amr.node_to_concepts.items():
+            i = res._index(node)
+            if i is None:   # only found in node_to_concepts
+                i = len(res._nodes)
+                res._nodes.append(symbols.intern(node))
+                res._offsets.append(len(res._rels))
+            res._concept_nodes.append(i)
+            res._concepts.append(symbols.intern(concept))
+        if len(res._nodes) > nNodes:
+            res._index_nodes()
+        res._node_concepts = array('i', [-1]) * len(res._nodes)
+        for i, c in zip(res._concept_nodes, res._concepts):
+            res._node_concepts[i] = c
+        return res
+
+    def to_amr(self):
+        """
+        Return a (modifiable) Amr with the same nodes, edges, roots, and concepts.
+        """
+        amr = self._fill(Amr())
+        amr.node_to_concepts = self.node_to_concepts
+        return amr
+
+    to_dag = to_amr
+
+    @property
+    def node_to_concepts(self):
+        """
+        A new dict mapping nodes to their concepts.
+        """
+        symbols, nodes = self.symbols, self._nodes
+        return dict((symbols[nodes[i]], symbols[c]) for i, c in zip(self._concept_nodes, self._concepts))
+
+    def get_concept(self, node):
+        """
+        Retrieve the concept name for a node.
+        """
+        i = self._index(node)
+        c = self._node_concepts[i] if i is not None else -1
+        if c < 0:
+            raise KeyError(node)
+        return self.symbols[c]
+
+    def triples(self, instances = True, start_node = None, **kwargs):
+        """
+        Retrieve a list of (node, role, filler) triples, in the same order as Amr.triples().
+        If instances is False do not include 'instance' roles.
+        """
+        res = CompactDag.triples(self, start_node)
+        if not instances:
+            return res
+        symbols, nodes = self.symbols, self._nodes
+        return res + [(symbols[nodes[i]], 'instance', symbols[c]) for i, c in zip(self._concept_nodes, self._concepts)]
+
+    def clone_canonical(self, external_dict = {}, prefix = ""):
+        """
+        Return a copy of the Amr with canonical node names (see Amr.clone_canonical()).
+        """
+        return self.to_amr().clone_canonical(external_dict, prefix)
+
+    def __str__(self):
+        return Amr.__str__.__func__(_Printed(self))
+
+    to_string = Amr.to_string.__func__
+
+class _Printed(object):
+    """
+    What printing a compact graph reads at every node, computed once.
+    """
+    def __init__(self, graph):
+        self._graph = graph
+        self.roots = graph.roots
+        self.external_nodes = graph.external_nodes
+        if isinstance(graph, CompactAmr):
+            self.node_to_concepts = graph.node_to_concepts
+
+    def __getitem__(self, node):
+        return self._graph[node]
+
+    dfs = Dag.dfs.__func__
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
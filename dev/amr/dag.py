@@ -7,15 +7,13 @@ Directed Acyclic Graphs.
 
 #from rule import Rule
 
-from collections import defaultdict
+from collections import defaultdict, deque, Counter
 from amr_parser import make_amr_parser, SpecialValue, StrLiteral, NonterminalLabel
 from operator import itemgetter
 import functools
-import unittest
 import re
 import sys
 import copy
-import pyparsing
 
 _graphics = False
 def require_graphics():
@@ -68,13 +66,38 @@ def flatten(ll):
     return [ll]
   
 ###Decode parse AST
+def run_steps(step, x):
+    """
+    Call the generator function 'step' on 'x' and, depth first, on each value it yields
+    before resuming it, as if every yield were a recursive call; uses an explicit stack 
+    instead of recursion.
+    >>> def step(x):
+    ...     print x
+    ...     for c in 'ab' if len(x) < 3 else '': yield x + c
+    >>> run_steps(step, '.')
+    .
+    .a
+    .aa
+    .ab
+    .b
+    .ba
+    .bb
+    """
+    stack = [step(x)]
+    while stack:
+        for child in stack[-1]:
+            stack.append(step(child))
+            break
+        else:
+            stack.pop()
+
 def ast_to_dag(ast):
     """
     Convert the abstract syntax tree returned by the dag parser into an dag.
     """
     dag = Dag()
 
-    def rec_step(x):  # Closure over dag
+    def rec_step(x):  # Closure over dag; yields the children to convert (see run_steps())
 
         node, concept, roles = x         
         if type(node) is str:
@@ -88,7 +111,7 @@ def ast_to_dag(ast):
                     tuple_child = (childnode,)
                     dag[node].append(role, tuple_child)
                     x = dag[childnode]
-                    rec_step(child)
+                    yield child
 
                 elif type(child) == list: #Hyperedge 
                     childnode = set()
@@ -101,7 +124,7 @@ def ast_to_dag(ast):
                                 new_c = c[0]
                             childnode.add(new_c)
                             x = dag[new_c]
-                            rec_step(c)
+                            yield c
                         else:
                             if type(c) is str and c.startswith("@"):
                                 c = c.replace("@","")
@@ -130,7 +153,7 @@ def ast_to_dag(ast):
 
         dag.roots.append(root[0].replace("@",""))
        
-        rec_step(root)
+        run_steps(rec_step, root)
     else: 
         if "@" in root:
             dag.external_nodes.append(root.replace("@",""))        
@@ -138,6 +161,23 @@ def ast_to_dag(ast):
 
     return dag 
 
+def _label_text(x):
+    """
+    A string for a relation or node label in canonical forms (unicode as UTF-8).
+    """
+    if isinstance(x, unicode):
+        return x.encode('utf-8')
+    return x if isinstance(x, str) else repr(x)
+
+def _first_tied(colour):
+    """
+    The nodes sharing the least colour that is shared by more than one node.
+    """
+    cells = defaultdict(list)
+    for n, c in colour.iteritems():
+        cells[c].append(n)
+    return min((c, nodes) for c, nodes in cells.iteritems() if len(nodes) > 1)[1]
+
 ###
 
 class ListMap(defaultdict):
@@ -205,6 +245,11 @@ class ListMap(defaultdict):
 
 
 
+class CycleError(ValueError):
+    """
+    Raised when an edge that would close a cycle is added with reject_cycles set.
+    """
+
 class Dag(defaultdict):
     """
     A directed acyclic graph permitting duplicate outgoing edge labels.
@@ -219,8 +264,19 @@ class Dag(defaultdict):
         self.replace_count = 0    # Count how many replacements have occured in this DAG
                                   # to prefix unique new node IDs for glued fragments.
 
+        self._version = 0       # incremented by every modification, to invalidate cached results
         self.__cached_triples = None
         self.__cached_depth = None
+        self.__cached_version = None
+        self.__cached_roots = None
+        self._in_index = None   # node -> incoming edges, built when first needed and then kept up to date
+        self._components = None # (version, result) of get_weakly_connected_roots()
+        self._canonical = None  # (what it depends on, result) of canonical_labeling()
+        self._order = None      # node -> position in a topological order, maintained by _add_triple()
+        self._order_next = 0    # next position after all nodes, for a new child
+        self._order_first = 0   # first position before all nodes, for a new parent
+        self._back_edges = {}   # (parent, child) -> count of the edges that close a cycle, which the order ignores
+        self._unsorted = set()  # nodes whose relations were not added in sorted order, or lost one (see update())
 
         self.node_alignments = {} 
         self.edge_alignments = {}
@@ -234,6 +290,7 @@ class Dag(defaultdict):
         """
         Initialize a new DAG from a Pennman style string.
         """
+        import pyparsing
         if not cls._parser_singleton: # Initialize the AMR parser only once
             _parser_singleton = make_amr_parser()           
         try:
@@ -244,11 +301,12 @@ class Dag(defaultdict):
         return ast_to_dag(ast)
 
     @classmethod
-    def from_triples(self, triples, roots=None, warn=sys.stderr):    
+    def from_triples(self, triples, roots=None, warn=sys.stderr, reject_cycles=False):    
         """
         Initialize a new DAG from a list of (parent, relation, child) triples.
         Optionally pass a list of root nodes (if empty, roots will be determined
-        automatically).
+        automatically). If 'reject_cycles' is set, a triple that would close a cycle 
+        raises CycleError.
 
         >>> y = Dag.from_triples([('3', u'ARG1', ('5',)), ('2', u'ARG1', ('4',)), ('2', 'location', ('0',)), ('0', 'name', ('1',)), ('1', 'op4', (u'"Exchange"',)), ('1', 'op1', (u'"New"',)), ('1', 'op2', (u'"York"',)), ('1', 'op3', (u'"Stock"',))])               
         >>> x = Dag.from_triples(y.triples() + [('4', 'mod', '2')]) #doctest:+ELLIPSIS
@@ -257,39 +315,7 @@ class Dag(defaultdict):
         dag = Dag() # Make new DAG
 
         for parent, relation, child in triples: 
-            if isinstance(parent, basestring):
-                new_par = parent.replace("@","")       
-                if parent.startswith("@"):
-                    dag.external_nodes.append(new_par)
-            else:
-                new_par = parent
-
-            if type(child) is tuple: 
-                new_child = []
-                for c in child: 
-                    if isinstance(c, basestring):
-                        new_c = c.replace("@","")
-                        new_child.append(new_c)
-                        nothing = dag[new_c]
-                        if c.startswith("@"):
-                            dag.external_nodes.append(new_c)
-                    else:
-                        nothing = dag[c] 
-                        new_child.append(c)
-                new_child = tuple(new_child)
-            else: # Allow triples to have single string children for convenience. 
-                  # and downward compatibility.
-                if isinstance(child, basestring):
-                    tmpchild = child.replace("@","")
-                    if child.startswith("@"):
-                        dag.external_nodes.append(tmpchild)
-                    new_child = (tmpchild,)
-                    nothing = dag[tmpchild]
-                else:
-                    new_child = (child,)
-                    nothing = dag[child]
-            
-            dag._add_triple(new_par, relation, new_child, warn=warn)
+            dag._insert_triple(parent, relation, child, warn=warn, reject_cycles=reject_cycles)
         
         # Allow the passed root to be either an iterable of roots or a single root
         if roots: 
@@ -303,11 +329,51 @@ class Dag(defaultdict):
 
 
 
+    def _insert_triple(self, parent, relation, child, warn=sys.stderr, reject_cycles=False):
+        """
+        Add a triple as from_triples() does: '@' marks external nodes and is stripped,
+        and a single child is turned into a 1-tuple.
+        """
+        if isinstance(parent, basestring):
+            new_par = parent.replace("@","")       
+            if parent.startswith("@"):
+                self.external_nodes.append(new_par)
+        else:
+            new_par = parent
+
+        if type(child) is tuple: 
+            new_child = []
+            for c in child: 
+                if isinstance(c, basestring):
+                    new_c = c.replace("@","")
+                    new_child.append(new_c)
+                    nothing = self[new_c]
+                    if c.startswith("@"):
+                        self.external_nodes.append(new_c)
+                else:
+                    nothing = self[c] 
+                    new_child.append(c)
+            new_child = tuple(new_child)
+        else: # Allow triples to have single string children for convenience. 
+              # and downward compatibility.
+            if isinstance(child, basestring):
+                tmpchild = child.replace("@","")
+                if child.startswith("@"):
+                    self.external_nodes.append(tmpchild)
+                new_child = (tmpchild,)
+                nothing = self[tmpchild]
+            else:
+                new_child = (child,)
+                nothing = self[child]
+        
+        self._add_triple(new_par, relation, new_child, warn=warn, reject_cycles=reject_cycles)
+        return new_par, new_child
+
     def dfs(self, extractor = lambda node, firsthit, leaf: node.__repr__(), combiner = lambda par,\
             childmap, depth: {par: childmap.items()}, hedge_combiner = lambda x: tuple(x)):
         """
-        Recursively traverse the dag depth first starting at node. When traveling up through the
-        recursion a value is extracted from each child node using the provided extractor method,
+        Traverse the dag depth first starting at the roots. When traveling back up from a node
+        a value is extracted from each child node using the provided extractor method,
         then the values are combined using the provided combiner method. At the root node the
         result of the combiner is returned. Extractor takes a "firsthit" argument that is true
         the first time a node is touched. 
@@ -316,7 +382,9 @@ class Dag(defaultdict):
         tabu_edge = set()
 
         def rec_step(node, depth):
-
+            # Yields the (child, depth) pairs to descend into and receives their values, 
+            # then yields (None, value). The generators are run from an explicit stack,
+            # so the depth of the DAG is not limited by the recursion limit.
 
             if type(node) is tuple: # Hyperedge case
                 pass
@@ -338,16 +406,28 @@ class Dag(defaultdict):
                             #pass
                         else:
                             tabu_edge.add((n, rel, child))
-                            child_map.append(rel, rec_step(child, depth + 1))
+                            child_map.append(rel, (yield (child, depth + 1)))
 
                 if child_map: 
                     combined = combiner(extracted, child_map, depth)
                     allnodes.append(combined)
                 else: 
                     allnodes.append(extracted)
-            return hedge_combiner(allnodes)
-
-        return [rec_step(node, 0) for node in self.roots]
+            yield None, hedge_combiner(allnodes)
+
+        res = []
+        for root in self.roots:
+            stack = [rec_step(root, 0)]
+            value = None
+            while stack:
+                child, value = stack[-1].send(value)
+                if child is None:   # finished
+                    stack.pop()
+                else:
+                    stack.append(rec_step(child, value))
+                    value = None
+            res.append(value)
+        return res
 
     def clone(self):
         """
@@ -363,47 +443,183 @@ class Dag(defaultdict):
     
     ####Hashing methods###                        
 
-    def _get_node_hashes(self):
-        tabu = set()
-        queue = []
-        node_to_id = defaultdict(int) 
-        for x in sorted(self.roots):
-            if type(x) is tuple: 
-                for y in x: 
-                    queue.append((y,0))
-                    node_to_id[y] = 0
-            else:          
-                queue.append((x,0)) 
-                node_to_id[x] = 0    
-        while queue: 
-            node, depth = queue.pop(0)            
-            if not node in tabu:
-                tabu.add(node)
-                rels = tuple(sorted(self[node].keys()))
-                node_to_id[node] += 13 * depth + hash(rels) 
-    
-                for rel in rels:
-                    children = self[node].getall(rel)
-                    for child in children:
-                        if not child in node_to_id: 
-                            if type(child) is tuple:
-                                for c in child: 
-                                    node_to_hash = 41 * depth
-                                    queue.append((c, depth+1))
-                            else:
-                                node_to_hash = 41 * depth 
-                                queue.append((child, depth+1))
-        return node_to_id                    
-  
+    def _node_label(self, node):
+        """
+        The part of a node's identity that is kept in the canonical form. 
+        For a DAG, node identifiers are arbitrary, so this is empty.
+        """
+        return ''
+
+    def canonical_labeling(self):
+        """
+        Return the canonical form of the DAG as a string, and a map from its nodes 
+        (those reachable from the roots) to their numbers in it. Isomorphic DAGs (with the same
+        roots, external nodes, and node labels) have the same canonical form.
+
+        Nodes are first distinguished by colour refinement: starting from their labels and 
+        whether they are roots, nodes get the same colour only as long as they have the same colour
+        and the same multisets of (relation, colour) in- and out-edges. Nodes of the same colour
+        with the very same in-edges and either the very same out-edges (such as leaves with the 
+        same parent and relation) or trees below them that no other edge leads into are 
+        interchangeable, so they are told apart in any order. Remaining ties are broken by 
+        trying each node of the first tied class in turn and keeping the least resulting form; 
+        nodes that an automorphism found along the way maps onto an already tried node are skipped.
+        The result is cached until the DAG, its roots, external nodes, or node labels change.
+        >>> x = Dag.from_triples([('a', 'B', 'c'), ('a', 'B', 'd'), ('c', 'E', 'd')])
+        >>> y = Dag.from_triples([('y', 'B', 'z'), ('y', 'B', 'x'), ('x', 'E', 'z')])
+        >>> x.canonical_labeling()[0] == y.canonical_labeling()[0]
+        True
+        >>> sorted(x.canonical_labeling()[1].items())
+        [('a', 0), ('c', 2), ('d', 1)]
+        >>> Dag.from_triples([('a', 'B', 'c'), ('d', 'E', 'f')], roots=['a', 'd']) == Dag.from_triples([('a', 'B', 'c'), ('d', 'E', 'f')], roots=['d', 'a'])
+        True
+        """
+        roots = self.roots
+        external = set(self.external_nodes)
+        edges = [(p, _label_text(r), c) for p, r, c in Dag.triples(self)]
+        nodes = list(roots)
+        out_edges = defaultdict(list)
+        in_edges = defaultdict(list)
+        for p, r, child in edges:
+            nodes.append(p)
+            for i, c in enumerate(child):
+                nodes.append(c)
+                out_edges[p].append((r, i, c))
+                in_edges[c].append((r, i, p))
+        nodes = list(set(nodes))
+        labels = dict((n, _label_text(self._node_label(n))) for n in nodes)
+        key = (self._version, list(roots), self.external_nodes[:], labels)
+        if self._canonical is not None and self._canonical[0] == key:
+            form, colour = self._canonical[1]
+            return form, dict(colour)
+        root_set = set(roots)
+
+        # what interchangeable nodes share: the edges into them (with the other children of 
+        # hyperedges), and the edges out of them or only that they head a tree of simple edges
+        ids = dict((n, k) for k, n in enumerate(nodes))
+        context = defaultdict(list)
+        for p, r, child in edges:
+            for i, c in enumerate(child):
+                context[c].append((r, i, ids[p], tuple(ids[x] for x in child[:i] + child[i+1:])))
+        heads_tree = {}
+        for n in nodes:     # post-order, without recursion; nodes on cycles head no tree
+            stack = [(n, False)]
+            while stack:
+                m, done = stack.pop()
+                if done:
+                    heads_tree[m] = all(len(child) == 1 and len(context[child[0]]) == 1 and heads_tree.get(child[0])
+                                        for r, child in (dict.get(self, m) or {}).items())
+                elif m not in heads_tree:
+                    heads_tree[m] = None
+                    stack.append((m, True))
+                    stack.extend((c, False) for r, child in (dict.get(self, m) or {}).items() for c in child
+                                 if c not in heads_tree)
+        twin_key = dict((n, (tuple(sorted(context[n])), heads_tree[n] or
+                             tuple(sorted((_label_text(r), tuple(ids[c] for c in child))
+                                          for r, child in (dict.get(self, n) or {}).items()))))
+                        for n in nodes)
+
+        def relabel(signature):
+            ranks = dict((sig, k) for k, sig in enumerate(sorted(set(signature.values()))))
+            return dict((n, ranks[sig]) for n, sig in signature.iteritems())
+
+        def refine(colour):
+            n_colours = len(set(colour.values()))
+            while True:
+                colour = relabel(dict((n, (colour[n], 
+                                           tuple(sorted((r, i, colour[c]) for r, i, c in out_edges[n])),
+                                           tuple(sorted((r, i, colour[p]) for r, i, p in in_edges[n]))))
+                                      for n in nodes))
+                if len(set(colour.values())) == n_colours:
+                    return colour
+                n_colours = len(set(colour.values()))
+
+        def split_twins(colour):    # refine, then number interchangeable nodes apart
+            while True:
+                colour = refine(colour)
+                twins = defaultdict(list)
+                for n, c in colour.iteritems():
+                    twins[(c, twin_key[n])].append(n)
+                rank = {}
+                for group in twins.itervalues():
+                    for k, n in enumerate(group[1:]):
+                        rank[n] = k + 1
+                if not rank:
+                    return colour
+                colour = relabel(dict((n, (c, rank.get(n, 0))) for n, c in colour.iteritems()))
+
+        def form(colour):
+            lines = ["%d %s" % (colour[n], labels[n]) for n in sorted(nodes, key=colour.get)]
+            lines.extend(sorted("%d :%s %s" % (colour[p], r, " ".join(str(colour[c]) for c in child))
+                                for p, r, child in edges))
+            lines.append("roots %s" % " ".join(sorted(str(colour[n]) for n in roots)))
+            lines.append("external %s" % " ".join(sorted(str(colour[n]) for n in external if n in colour)))
+            return "\n".join(lines)
+
+        def individualize(colour, node):
+            return relabel(dict((n, (c, n != node)) for n, c in colour.iteritems()))
+
+        def first_leaf(colour):     # a discrete colouring, choosing arbitrarily among tied nodes
+            colour = split_twins(colour)
+            while len(set(colour.values())) < len(nodes):
+                cell = _first_tied(colour)
+                colour = split_twins(individualize(colour, cell[0]))
+            return colour
+
+        def search(colour):     # the least (form, colouring) below this partition
+            colour = split_twins(colour)
+            if len(set(colour.values())) == len(nodes):
+                return form(colour), colour
+            best = None
+            tried = []  # (node, form of a leaf below it)
+            for node in _first_tied(colour):
+                branch = individualize(colour, node)
+                if tried:
+                    # skip 'node' if some tried node is mapped onto it by an automorphism
+                    leaf_form = form(first_leaf(branch))
+                    if any(f == leaf_form for n, f in tried):
+                        continue
+                else:
+                    leaf_form = None
+                result = search(branch)
+                if leaf_form is None:
+                    leaf_form = form(first_leaf(branch))
+                tried.append((node, leaf_form))
+                if best is None or result[0] < best[0]:
+                    best = result
+            return best
+
+        initial = relabel(dict((n, (n not in root_set, labels[n], n in external)) for n in nodes))
+        form, colour = search(initial)
+        self._canonical = (key, (form, colour))
+        return form, dict(colour)
+
+    def canonical_form(self):
+        """
+        Return a string that is the same for two DAGs if and only if they are isomorphic
+        (see canonical_labeling()).
+        """
+        return self.canonical_labeling()[0]
+
     def __hash__(self):
-        # We compute a hash for each node in the AMR and then sum up the hashes. 
-        # Colisions are minimized because each node hash is offset according to its distance from
-        # the root.
-        node_to_id = self._get_node_hashes()
-        return sum(node_to_id[node] for node in node_to_id)
+        return hash(self.canonical_form())
 
     def __eq__(self, other):
-        return hash(self) == hash(other)
+        """
+        Two DAGs are equal if they are isomorphic.
+        >>> Dag.from_triples([('a', 'B', 'c'), ('c', 'D', 'e')]) == Dag.from_triples([('x', 'B', 'y'), ('y', 'D', 'z')])
+        True
+        >>> Dag.from_triples([('a', 'B', 'c'), ('c', 'D', 'e')]) == Dag.from_triples([('x', 'B', 'y'), ('x', 'D', 'z')])
+        False
+        """
+        if self is other:
+            return True
+        if not isinstance(other, Dag) or len(Dag.triples(self)) != len(Dag.triples(other)):
+            return False
+        return self.canonical_form() == other.canonical_form()
+
+    def __ne__(self, other):
+        return not self == other
     
     ### Methods that provide information about this DAG in different formats.###
     def get_nodes(self):
@@ -423,9 +639,18 @@ class Dag(defaultdict):
     def triples(self, start_node = None, refresh = False, **kwargs):
         """
         Traverse the DAG breadth first to collect a list of (parent, relation, child) triples.
+        The list for the whole DAG is cached until the DAG or its roots change, 
+        so it must not be modified.
+        >>> x = Dag.from_triples([('a', 'B', 'c')])
+        >>> x.triples() is x.triples()
+        True
+        >>> x._add_triple('c', 'D', 'e')
+        >>> x.triples()
+        [('a', 'B', ('c',)), ('c', 'D', ('e',))]
         """
 
-        if (not (refresh or start_node)) and self.__cached_triples:
+        if not (refresh or start_node) and self.__cached_triples is not None \
+           and self.__cached_version == self._version and self.__cached_roots == self.roots:
             return self.__cached_triples
 
         triple_to_depth = {}
@@ -433,11 +658,11 @@ class Dag(defaultdict):
         tabu = set()
 
         if start_node:
-            queue = [(start_node,0)]
+            queue = deque([(start_node,0)])
         else:             
-            queue = [(x,0) for x in self.roots]
+            queue = deque((x,0) for x in self.roots)
         while queue: 
-            node, depth = queue.pop(0)
+            node, depth = queue.popleft()
             if not node in tabu:
                 tabu.add(node)
                 for rel, child in sorted(self[node].items(), key=itemgetter(0)):
@@ -455,16 +680,16 @@ class Dag(defaultdict):
         if not start_node:
             self.__cached_triples = triples
             self.__cached_depth = triple_to_depth
+            self.__cached_version = self._version
+            self.__cached_roots = list(self.roots)
         return triples 
 
     def get_all_depths(self):
-        if not self.__cached_depth:
-            self.triples()
+        self.triples()
         return self.__cached_depth
 
     def get_depth(self, triple):
-        if not self.__cached_depth:
-            self.triples()
+        self.triples()
         return self.__cached_depth[triple]
 
     def out_edges(self, node): 
@@ -483,31 +708,37 @@ class Dag(defaultdict):
     def get_all_in_edges(self):
         """
         Return dictionary mapping nodes to their incomping edges. 
+        The index is maintained by _add_triple() and _remove_triple(); do not modify it.
         """
-        res = defaultdict(list)
-        for node, rel, child in self.triples():
-            if type(child) is tuple:
-                for c in child:
-                    res[c].append((node,rel,child))
-            else:
-                res[child].append((node,rel,child))
-        return res
+        if self._in_index is None:
+            res = defaultdict(list)
+            for node, rels in self.items():
+                for rel, child in rels.items():
+                    if type(child) is tuple:
+                        for c in child:
+                            res[c].append((node,rel,child))
+                    else:
+                        res[child].append((node,rel,child))
+            self._in_index = res
+        return self._in_index
 
     def in_edges(self, node):
         """
         Return incoming edges for a single node.
+        >>> x = Dag.from_triples([('a', 'B', 'c'), ('d', 'E', 'c')])
+        >>> sorted(x.in_edges('c'))
+        [('a', 'B', ('c',)), ('d', 'E', ('c',))]
+        >>> x._remove_triple('a', 'B', ('c',))
+        >>> x.in_edges('c')
+        [('d', 'E', ('c',))]
         """
-        return self.get_all_in_edges()[node]
+        return list(self.get_all_in_edges().get(node, ()))
 
     def has_triple(self, parent, relation, child):
         """
         Return True if the DAG contains the given triple.
         """
-        try:
-            result = child in self[parent].get(relation)   
-        except (TypeError, ValueError):
-            return False
-        return result
+        return self.has_edge(parent, relation, child)
 
     def nonterminal_edges(self):
         """
@@ -534,13 +765,21 @@ class Dag(defaultdict):
                 res.add(c)
         return res
    
-    def find_roots(self, warn=sys.stderr):
-        """
-        Find and return a set of the roots of the DAG. This does NOT set the 'roots' attribute.
+    def find_roots(self, warn=sys.stderr, nodes=None):
+        """
+        Find and return a list of the roots of the DAG. This does NOT set the 'roots' attribute.
+        The roots are the nodes without parents, plus one node for each cycle that cannot be 
+        reached from them (the cycles are taken in order of the number of triples reachable from them).
+        Their order follows that of the nodes, which are taken from 'nodes' if given, 
+        otherwise from the keys of the DAG.
+        >>> Dag.from_triples([('a', 'B', 'c'), ('c', 'D', 'e'), ('e', 'F', 'c'), ('g', 'H', 'g')]).find_roots()
+        ['a', 'g']
+        >>> sorted(Dag.from_triples([('c', 'D', 'e'), ('e', 'F', 'c')]).find_roots())
+        ['e']
         """
         # there cannot be an odering of root nodes so it is okay to return a set
         parents = set()
-        for k in self.keys():
+        for k in (self.keys() if nodes is None else nodes):
             if type(k) is tuple:
                 parents.update(k)
             else: 
@@ -555,36 +794,89 @@ class Dag(defaultdict):
         roots = list(parents - children)
 
         not_found = parents.union(children)
-        for r in roots: 
-            x = self.triples(start_node = r, instances = False)
-            for p,r,c in x: 
-               if p in not_found:
-                   not_found.remove(p)
-               if type(c) is tuple: 
-                   for ch in c: 
-                       if ch in not_found:
-                           not_found.remove(ch)
-               if c in not_found: 
-                   not_found.remove(c)
-
-        while not_found:
-            parents = sorted([x for x in not_found if self[x]], key=lambda a:len(self.triples(start_node = a)))
-            if not parents: 
-                if warn: warn.write("WARNING: orphaned leafs %s.\n" % str(not_found))
-                roots.extend(list(not_found))
-                return roots
-            new_root = parents.pop()
-            for p,r,c in  self.triples(start_node = new_root):
-               if p in not_found:
-                   not_found.remove(p)
-               if type(c) is tuple: 
-                   for ch in c: 
-                       if ch in not_found:
-                           not_found.remove(ch)
-               if c in not_found: 
-                   not_found.remove(c)
-            roots.append(new_root)    
+        for x in self._reach_all([r for r in roots if self[r]]):
+            not_found.discard(x)   # one at a time: difference_update() may resize the set and change its order
+
+        # Every remaining node with children hangs below a cycle that no other remaining node
+        # leads into. Take these cycles from the one with the most reachable triples, preferring
+        # (among equals) the node that comes last in 'not_found', and remove what they reach.
+        candidates = [x for x in not_found if self[x]]
+        if candidates:
+            position = dict((x, i) for i, x in enumerate(candidates))
+            sources = []
+            for comp in self._source_components(candidates):
+                new_root = max(comp, key=position.get)
+                sources.append((len(Dag.triples(self, start_node = new_root)), position[new_root], new_root))
+            for size, pos, new_root in sorted(sources, reverse=True):
+                for x in self._reach_all([new_root]):
+                    not_found.discard(x)
+                roots.append(new_root)
+
+        if not_found:
+            if warn: warn.write("WARNING: orphaned leafs %s.\n" % str(not_found))
+            roots.extend(list(not_found))
         return roots    
+
+    def _reach_all(self, nodes):
+        """
+        Return the set of the given nodes and all nodes reachable from them.
+        """
+        res = set(nodes)
+        stack = list(res)
+        while stack:
+            for child in self[stack.pop()].values():
+                for c in (child if type(child) is tuple else (child,)):
+                    if c not in res:
+                        res.add(c)
+                        stack.append(c)
+        return res
+
+    def _source_components(self, nodes):
+        """
+        Return the strongly connected components (lists of nodes) of the subgraph on 'nodes' 
+        that have no incoming edges from other nodes of the subgraph (Tarjan's algorithm).
+        """
+        nodes = set(nodes)
+        def successors(n):
+            return [c for child in self[n].values() for c in (child if type(child) is tuple else (child,)) if c in nodes]
+        index, low, component = {}, {}, {}
+        stack, on_stack, comps = [], set(), []
+        for v in nodes:
+            if v in index: continue
+            index[v] = low[v] = len(index)
+            stack.append(v)
+            on_stack.add(v)
+            work = [(v, iter(successors(v)))]
+            while work:
+                n, it = work[-1]
+                for w in it:
+                    if w not in index:
+                        index[w] = low[w] = len(index)
+                        stack.append(w)
+                        on_stack.add(w)
+                        work.append((w, iter(successors(w))))
+                        break
+                    elif w in on_stack:
+                        low[n] = min(low[n], index[w])
+                else:
+                    work.pop()
+                    if work:
+                        low[work[-1][0]] = min(low[work[-1][0]], low[n])
+                    if low[n] == index[n]:
+                        comp = []
+                        while True:
+                            w = stack.pop()
+                            on_stack.discard(w)
+                            component[w] = len(comps)
+                            comp.append(w)
+                            if w is n: break
+                        comps.append(comp)
+        is_source = [True]*len(comps)
+        for n in nodes:
+            for c in successors(n):
+                if component[c] != component[n]:
+                    is_source[component[c]] = False
+        return [comp for i, comp in enumerate(comps) if is_source[i]]
    
     def get_ordered_nodes(self):
         """
@@ -646,64 +938,337 @@ class Dag(defaultdict):
     def get_weakly_connected_roots(self, warn=sys.stderr):
         """
         Return a set of root nodes for each weakly connected component.
+        The root chosen for a component is its first root in find_roots() order.
+        The result is cached until the DAG is modified.
         >>> x = Dag.from_triples([("a","B","c"), ("d","E","f")])
-        >>> x.get_weakly_connected_roots()
-        set(['a', 'd'])
+        >>> sorted(x.get_weakly_connected_roots())
+        ['a', 'd']
         >>> y = Dag.from_triples([("a","B","c"), ("d","E","f"),("c","H","f")],{})
         >>> y.get_weakly_connected_roots()
         set(['a'])
         >>> y.is_connected()
         True
-        """
+        >>> z = Dag.from_triples([("a","B","x"), ("b","B","x"), ("c","B","x")])
+        >>> len(z.get_weakly_connected_roots())
+        1
+        """
+        if self._components is not None and self._components[0] == self._version:
+            return self._components[1]
+
+        parent = {}     # disjoint-set forest over the nodes
+        def find(n):
+            root = n
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while n != root:    # path compression
+                parent[n], n = root, parent[n]
+            return root
+        for node, rels in self.items():
+            for rel, child in rels.items():
+                for c in (child if type(child) is tuple else (child,)):
+                    a, b = find(node), find(c)
+                    if a != b:
+                        parent[a] = b
 
-        roots = list(self.find_roots(warn=warn))
-        if len(roots) == 1:
-                return roots
-
-        merged  = defaultdict(list)
-        node_to_comp = defaultdict(list)
-        equiv = {}
-        for r in roots:
-            for n in self.reach(r):
-                node_to_comp[n].append(r)
-                if len(node_to_comp[n]) == 2: 
-                    if not r in equiv:
-                        equiv[r] = node_to_comp[n][0]    
-                
         final = set()
-        for r in roots: 
-            unique_repr = r
-            while unique_repr in equiv:
-                unique_repr = equiv[unique_repr]        
-            final.add(unique_repr)
-              
+        seen = set()
+        for r in self.find_roots(warn=warn):
+            comp = find(r)
+            if comp not in seen:
+                seen.add(comp)
+                final.add(r)
+        self._components = (self._version, final)
         return final
-        #new_roots = set()                       
-        #for r in nodes:
 
     def is_connected(self, warn=sys.stderr):
         return len(self.get_weakly_connected_roots(warn=warn)) == 1        
 
     ####Methods that modify the DAG###    
-    def _add_triple(self, parent, relation, child, warn=sys.stderr):
-        """
-        Add a (parent, relation, child) triple to the DAG. 
+    def _add_triple(self, parent, relation, child, warn=sys.stderr, reject_cycles=False):
+        """
+        Add a (parent, relation, child) triple to the DAG. If the new edge closes a cycle,
+        a warning naming the path that it closes is written to 'warn', or, if 'reject_cycles'
+        is set, CycleError is raised and the DAG is left unchanged.
+        >>> x = Dag.from_triples([('a', 'B', 'c'), ('c', 'D', 'e')])
+        >>> x._add_triple('e', 'F', 'a', warn=sys.stdout)
+        WARNING: (e, F, ('a',)) would produce a cycle with (a, B, ('c',)), (c, D, ('e',))
+        >>> x._add_triple('e', 'G', 'c', reject_cycles=True)
+        Traceback (most recent call last):
+          ...
+        CycleError: (e, G, ('c',)) would produce a cycle with (c, D, ('e',))
+        >>> x.has_edge('e', 'G', ('c',))
+        False
         """
         if type(child) is not tuple:
             child = (child,)
         if parent in child: 
             #raise Exception('self edge!')
             #sys.stderr.write("WARNING: Self-edge (%s, %s, %s).\n" % (parent, relation, child))
+            if reject_cycles:
+                raise CycleError, "Cannot add self-edge (%s, %s, %s)." % (parent, relation, child)
             if warn: warn.write("WARNING: Self-edge (%s, %s, %s).\n" % (parent, relation, child))
-            #raise ValueError, "Cannot add self-edge (%s, %s, %s)." % (parent, relation, child)
+        back = [parent] if parent in child else []
         for c in child: 
             x = self[c]
-            for rel, test in self[c].items():
-                if parent in test: 
-                   if warn: warn.write("WARNING: (%s, %s, %s) would produce a cycle with (%s, %s, %s)\n" % (parent, relation, child, c, rel, test))
-                    #raise ValueError,"(%s, %s, %s) would produce a cycle with (%s, %s, %s)" % (parent, relation, child, c, rel, test)
-        self[parent].append(relation, child)    
+            if c == parent: continue
+            path = self._cycle_path(parent, c)
+            if path:
+                msg = "(%s, %s, %s) would produce a cycle with %s" % (parent, relation, child, 
+                      ", ".join("(%s, %s, %s)" % t for t in path))
+                if reject_cycles:
+                    raise CycleError, msg
+                if warn: warn.write("WARNING: %s\n" % msg)
+                back.append(c)
+        if back:
+            order = self._topological_order()   # before the edge is in the graph
+            if parent not in order:     # a new node with a self-edge
+                order[parent] = self._order_next
+                self._order_next += 1
+        rels = self[parent]
+        if relation not in rels and rels and max(rels) > relation:
+            self._unsorted.add(parent)
+        rels.append(relation, child)
+        self._version += 1
+        for c in back:
+            self._back_edges[(parent, c)] = self._back_edges.get((parent, c), 0) + 1
+        if self._in_index is not None:
+            for c in child:
+                self._in_index[c].append((parent, relation, child))
+
+    def _topological_order(self):
+        """
+        Return the node -> position map kept by _add_triple(), computing it if necessary.
+        The edges in _back_edges, which close cycles, go against the order; all others follow it.
+        >>> x = Dag.from_triples([('a', 'B', 'c'), ('c', 'D', 'a'), ('c', 'E', 'f')], warn=None)
+        >>> x._order = None
+        >>> order = x._topological_order()
+        >>> order['a'] < order['c'] < order['f'], x._back_edges
+        (True, {('c', 'a'): 1})
+        """
+        if self._order is None:
+            indegree = defaultdict(int)
+            for node, rels in self.items():
+                for rel, child in rels.items():
+                    for c in child:
+                        indegree[c] += 1
+            nodes = list(self)
+            queue = deque(n for n in nodes if not indegree[n])
+            order = {}
+            back = {}
+            next_node = 0
+            while len(order) < len(nodes):
+                if not queue:   # all remaining nodes lie on or below cycles: break one at the next node
+                    while nodes[next_node] in order:
+                        next_node += 1
+                    n = nodes[next_node]
+                    for p, rel, child in self.get_all_in_edges().get(n, ()):
+                        if p not in order:
+                            back[(p, n)] = back.get((p, n), 0) + 1
+                    indegree[n] = 0
+                    queue.append(n)
+                n = queue.popleft()
+                order[n] = len(order)
+                for rel, child in dict.get(self, n, {}).items():
+                    for c in child:
+                        indegree[c] -= 1
+                        if not indegree[c]:
+                            queue.append(c)
+            self._order = order
+            self._order_next = len(order)
+            self._order_first = 0
+            self._back_edges = back
+        return self._order
+
+    def _cycle_path(self, parent, child):
+        """
+        Return the path of triples from 'child' to 'parent' if an edge from 'parent' to 'child'
+        would close a cycle, and an empty list otherwise. A topological order of the nodes
+        is maintained (Pearce & Kelly's dynamic topological sort): only nodes between 'child' 
+        and 'parent' in that order are searched, and they are reordered to make room for the 
+        new edge. A path that leaves that range can only come back through one of the
+        _back_edges, so the search also covers the nodes up to those that lead back into it.
+        >>> x = Dag.from_triples([('c', 'D', 'e'), ('b', 'C', 'c'), ('a', 'B', 'b')])
+        >>> x._order['a'] < x._order['b'] < x._order['c'] < x._order['e']
+        True
+        """
+        order = self._topological_order()
+        new = False
+        if child not in order:      # a new node has no edges, so the new edge cannot close a cycle
+            order[child] = self._order_next
+            self._order_next += 1
+            new = True
+        if parent not in order:
+            self._order_first -= 1
+            order[parent] = self._order_first
+            new = True
+        if new:
+            return []
+        lower, upper = order[child], order[parent]
+        bound = upper
+        while True:
+            back = [order[p] for p, c in self._back_edges if order[p] > bound >= order[c]]
+            if not back: break
+            bound = max(back)
+        if lower > bound:
+            return []
+        path, forward = self._search_path(child, parent, lambda n: order[n] <= bound)
+        if path or lower > upper:
+            return path
+        # nodes that reach 'parent' and come after 'child' have to move before the nodes in 'forward' 
+        forward = [n for n in forward if lower <= order[n] <= upper]
+        in_index = self.get_all_in_edges()
+        backward = [parent]
+        seen = set(backward)
+        stack = [parent]
+        while stack:
+            for p, rel, ch in in_index.get(stack.pop(), ()):
+                if p not in seen and lower < order[p] <= upper:
+                    seen.add(p)
+                    backward.append(p)
+                    stack.append(p)
+        nodes = sorted(backward, key=order.get) + sorted(forward, key=order.get)
+        for n, pos in zip(nodes, sorted(order[n] for n in nodes)):
+            order[n] = pos
+        return []
+
+    def _search_path(self, start, goal, admissible):
+        """
+        Depth-first search from 'start' through nodes for which 'admissible' holds.
+        Return the path of triples to 'goal' (or an empty list if it is not reached) 
+        and the list of nodes visited.
+        """
+        via = {start: None}
+        visited = [start]
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for rel, child in dict.get(self, node, {}).items():
+                for c in child:
+                    if c in via or not admissible(c): continue
+                    via[c] = (node, rel, child)
+                    if c == goal:
+                        path = []
+                        while via[c] is not None:
+                            path.append(via[c])
+                            c = via[c][0]
+                        return path[::-1], visited
+                    visited.append(c)
+                    stack.append(c)
+        return [], visited
     
+    def update(self, new_triples=(), avoid_triples=(), warn=sys.stderr, reject_cycles=False):
+        """
+        Modify the DAG in place, removing the triples in 'avoid_triples' and adding 'new_triples'.
+        Nodes left without any edges are dropped, and the roots are kept up to date: a node
+        that loses its last parent becomes a root, and a root that gains a parent stops
+        being one. Only the new triples are checked for cycles. Roots and relations iterate 
+        in the same order as in Dag.from_triples() of the remaining triples (as listed by 
+        triples()) followed by the new ones.
+        >>> x = Dag.from_triples([('a', 'B', 'c'), ('d', 'E', 'f')])
+        >>> x.update([('c', 'G', 'd')], [('d', 'E', ('f',))])
+        >>> x.triples(), x.roots, 'f' in x
+        ([('a', 'B', ('c',)), ('c', 'G', ('d',))], ['a'], False)
+        >>> x.update([('h', 'I', 'a')], [('c', 'G', ('d',))])
+        >>> x.triples(), x.roots
+        ([('h', 'I', ('a',)), ('a', 'B', ('c',))], ['h'])
+        >>> new = [('j', 'K', ('l',)), ('m', 'N', ('o',)), ('p', 'Q', ('r',))]
+        >>> rebuilt = Dag.from_triples(x.triples() + new)
+        >>> x.update(new)
+        >>> x.roots == rebuilt.roots, len(x.roots)
+        (True, 4)
+        """
+        listing = Dag.triples(self) if avoid_triples else None   # as a rebuild would list them
+        in_index = self.get_all_in_edges()
+        self._topological_order()
+        cyclic = bool(self._back_edges)
+        roots = self.roots
+        old_roots = list(roots)
+        added = []
+        for parent, relation, child in avoid_triples:
+            while self.has_edge(parent, relation, child):
+                self._remove_triple(parent, relation, child)
+                for c in child:
+                    if in_index.get(c) or c == parent:
+                        continue
+                    if dict.get(self, c):
+                        roots.append(c)     # lost its last parent
+                    else:
+                        self._drop_node(c)
+                if not dict.get(self, parent) and not in_index.get(parent):
+                    if parent in roots:
+                        roots.remove(parent)
+                    self._drop_node(parent)
+        # a rebuild adds each node's relations in sorted order, which determines the order in
+        # which they iterate (e.g. in dfs()); redo this for the nodes where it would differ
+        for node in self._unsorted:
+            rels = dict.__getitem__(self, node)
+            items = sorted(rels.items(), key=itemgetter(0))
+            dict.clear(rels)
+            for relation, child in items:
+                rels.append(relation, child)
+        self._unsorted.clear()
+        for parent, relation, child in new_triples:
+            parent, child = self._insert_triple(parent, relation, child, warn=warn, reject_cycles=reject_cycles)
+            added.append((parent, relation, child))
+            cyclic = cyclic or bool(self._back_edges)
+            rels = dict.__getitem__(self, parent)
+            if not in_index.get(parent) and len(rels) == 1 and len(rels.getall(relation)) == 1 \
+               and parent not in roots:
+                roots.append(parent)        # a new node
+            for c in child:
+                if c != parent and len(in_index[c]) == 1 and dict.get(self, c) and c in roots:
+                    roots.remove(c)         # gained its first parent
+        if cyclic or len(roots) > 1:
+            # find_roots() orders the roots by dict and set iteration order, which depends on
+            # the order in which the nodes were added: replay that of a rebuild
+            if listing is None:
+                listing = self._listing(old_roots, added)
+            nodes = {}
+            for parent, relation, child in [t for t in listing if t not in avoid_triples] + added:
+                for c in child:
+                    nodes[c] = None
+                nodes[parent] = None
+            self.roots = self.find_roots(warn=warn, nodes=nodes.keys())
+
+    def _listing(self, roots, skip):
+        """
+        Return the triples in the order triples() would list them from 'roots' if the triples
+        in 'skip' had not been added last (as update() adds them).
+        >>> x = Dag.from_triples([('a', 'B', 'c'), ('a', 'B', 'd'), ('d', 'E', 'f')])
+        >>> x._listing(['a'], [('a', 'B', ('d',))])
+        [('a', 'B', ('c',))]
+        """
+        skip = Counter(skip)
+        res = []
+        tabu = set()
+        queue = deque(roots)
+        while queue:
+            node = queue.popleft()
+            if node in tabu:
+                continue
+            tabu.add(node)
+            items = sorted(self[node].items(), key=itemgetter(0))
+            for i in reversed(xrange(len(items))):
+                if skip[(node,) + items[i]]:
+                    skip[(node,) + items[i]] -= 1
+                    del items[i]
+            for rel, child in items:
+                res.append((node, rel, child))
+                queue.extend(c for c in child if c not in tabu)
+        return res
+
+    def _drop_node(self, node):
+        """
+        Delete a node without edges from the DAG and its indexes.
+        """
+        self.pop(node, None)
+        self._version += 1
+        if self._in_index is not None:
+            self._in_index.pop(node, None)
+        if self._order is not None:
+            self._order.pop(node, None)
+        self._unsorted.discard(node)
+
     def _replace_triple(self, parent1, relation1, child1, parent2, relation2, child2, warn=sys.stderr):
         """
         Delete a (parent, relation, child) triple from the DAG. 
@@ -719,6 +1284,17 @@ class Dag(defaultdict):
             self[parent].remove(relation, child)    
         except ValueError:
             raise ValueError, "(%s, %s, %s) is not an AMR edge." % (parent, relation, child) 
+        self._version += 1
+        if relation not in self[parent]:
+            self._unsorted.add(parent)
+        for c in (child if type(child) is tuple else (child,)):
+            if self._in_index is not None:
+                self._in_index[c].remove((parent, relation, child))
+            count = self._back_edges.get((parent, c))
+            if count == 1:
+                del self._back_edges[(parent, c)]
+            elif count:
+                self._back_edges[(parent, c)] = count - 1
 
     ###Specific methods for hyperedge replacement###
     def apply_node_map(self, node_map):
@@ -748,15 +1324,13 @@ class Dag(defaultdict):
     def _get_canonical_nodes(self, prefix = ""):
         """
         Get a mapping from node identifiers to IDs of the form x[prefix]number.
-        This uses the hash code for each node which only depend on DAG topology (not on node IDs).
-        Therefore two DAGs with the same structure will receive the same canonical node labels.
-        """
-        # Get node hashes, then sort according to hash_code and use the index into this
-        # sorted list as new ID.
-        node_hashes = self._get_node_hashes()
-        nodes = node_hashes.keys() 
-        nodes.sort(lambda x,y: cmp(int(node_hashes[x]),int(node_hashes[y]))) 
-        return dict([(node.replace("@",""), "x%s%s" % (prefix, str(node_id)) ) for node_id, node in enumerate(nodes)])
+        The numbers are those of canonical_labeling(), which only depend on the structure
+        of the DAG (not on node IDs). Therefore two DAGs with the same structure will 
+        receive the same canonical node labels.
+        """
+        labeling = self.canonical_labeling()[1]
+        return dict([(node.replace("@","") if isinstance(node, basestring) else node, "x%s%s" % (prefix, str(node_id)))
+                     for node, node_id in labeling.items()])
     
     def clone_canonical(self, external_dict = {}, prefix = ""):
         """
@@ -790,7 +1364,10 @@ class Dag(defaultdict):
         """
         Remove a collection of hyperedges from the DAG.
         """
-        res_dag = Dag.from_triples([edge for edge in self.triples() if not dag.has_edge(*edge)])
+        res_dag = Dag() # roots are taken from this DAG, so no need for from_triples() to find them
+        for edge in self.triples():
+            if not dag.has_edge(*edge):
+                res_dag._insert_triple(*edge)
         res_dag.roots = [r for r in self.roots if r in res_dag]
         res_dag.external_nodes = [n for n in self.external_nodes if n in res_dag]
         return res_dag
@@ -10,9 +10,9 @@ from __future__ import print_function
 import os, sys, re, codecs, fileinput
 
 import pipeline
-from pipeline import new_concept, new_amr_from_old, get_or_create_concept_from_token as amrget
+from pipeline import new_concept, update_amr, get_or_create_concept_from_token as amrget
 
-def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, completed):
+def main(sentenceId, sentence, tokens, ww, wTags, depParse, inAMR, alignment, completed):
     amr = inAMR
     for deps in depParse:
         if deps is None: continue
@@ -32,7 +32,7 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
                     newtriple = (str(x), r.replace('_','-'), str(y))
                 
                 
-                amr = new_amr_from_old(amr, new_triples=[newtriple])
+                update_amr(amr, new_triples=[newtriple])
 
                 completed[1][(h,i)] = True
 
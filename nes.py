@@ -9,7 +9,7 @@ from __future__ import print_function
 import os, sys, re, codecs, fileinput, json
 
 import pipeline
-from pipeline import new_concept_from_token, choose_head, new_concept, new_amr_from_old, parent_edges
+from pipeline import new_concept_from_token, new_concept, new_amr_from_old, parent_edges
 
 '''
 Example input, from wsj_0002.0:
@@ -39,16 +39,16 @@ Example input, from wsj_0002.0:
 
 
 
-def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, completed):
+def main(sentenceId, sentence, tokens, ww, wTags, depParse, inAMR, alignment, completed):
     amr = inAMR
     triples = set() # to add to the AMR
     
-    entities = pipeline.loadBBN(jsonFile)
+    entities = pipeline.loadBBN(sentence)
     for i,j,name,coarse,fine,raw in entities:
         
         if raw.startswith('<TIMEX'): continue  # use the timex module (sutime output) instead
         
-        h = choose_head(range(i,j+1), depParse, 
+        h = sentence.index.choose_head(i, j, 
                         fallback=lambda frontier: max(frontier) if len(frontier)==2 and ww[min(frontier)]=='than' else False)
                         # ^ dirty hack: in 'more than 3 times' (wsj_0003.12), [more than 3] is a value expression 
                         # but 'than' and '3' both attach to 'times' in the dependency parse.
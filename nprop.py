@@ -8,7 +8,7 @@ from __future__ import print_function
 import os, sys, re, codecs, fileinput, json
 
 import pipeline, config, verbalize
-from pipeline import Atom, choose_head, new_concept, new_concept_from_token, new_amr_from_old, parent_edges, get_or_create_concept_from_token as amrget
+from pipeline import Atom, new_concept, new_concept_from_token, new_amr_from_old, parent_edges, get_or_create_concept_from_token as amrget
 from vprop import common_arg
 
 #TODO: the example below is buggy
@@ -120,11 +120,11 @@ Example input, from wsj_0002.0:
 
 
 
-def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, completed):
+def main(sentenceId, sentence, tokens, ww, wTags, depParse, inAMR, alignment, completed):
     amr = inAMR
     triples = set() # to add to the AMR
     
-    props = pipeline.loadNProp(jsonFile)
+    props = pipeline.loadNProp(sentence)
     
     predheads = {}  # map head index to nominal predicate variable (not reflected in the alignment)
     
@@ -174,7 +174,7 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
             if i is None or j is None: continue # TODO: special PropBank cases that need further work
             if rel in ['rel', 'Support']: continue
             assert rel[:3]=='ARG'
-            h = choose_head(range(i,j+1), depParse)
+            h = sentence.index.choose_head(i, j)
             if h is None: continue # TODO: improve coverage of complex spans
             
             # handle general proposition arguments
@@ -0,0 +1,146 @@
+'''
+Output side of the pipeline: writers for the AMRs of processed sentences,
+and rate-limited progress reporting.
+
+A writer receives one record per sentence (see make_record()) and writes it,
+block-buffered, as Penman text (the same layout pipeline.py prints to stdout)
+or as JSONL with the sentence ID, AMR string, triples, alignments, and timing.
+Files ending in .gz are gzip-compressed.
+
+@see: pipeline.py options --output, --format, --progress
+'''
+from __future__ import print_function
+import sys, json, time
+from collections import OrderedDict
+
+BUFFER_SIZE = 1<<20
+'''Bytes of output collected before writing them out'''
+
+EMPTY_AMR = '(x1 / amr-empty)'
+
+def _json_value(v):
+    return v if isinstance(v, (int, long, float)) else unicode(str(v), 'utf-8')
+
+def make_record(sentenceId, ww=None, amr=None, alignments=None):
+    '''
+    The output for one sentence, as an ordered dict with the sentence ID,
+    the sentence, the AMR (in Penman notation), and the AMR's triples (without instances).
+    If 'alignments' is given, it is included as a list of [variable, token offset] pairs,
+    or as [x, relation, y, token] for the triple-to-token alignments made by beautify.
+    If 'amr' is None, the AMR is (x1 / amr-empty).
+    '''
+    rec = OrderedDict([('id', sentenceId), ('sentence', ' '.join(filter(None, ww)) if ww else None)])
+    if amr is None:
+        rec['amr'] = EMPTY_AMR
+        rec['triples'] = []
+    else:
+        rec['amr'] = unicode(str(amr), 'utf-8')
+        rec['triples'] = [[_json_value(x), _json_value(r), _json_value(y)] for x,r,(y,) in amr.triples(instances=False)]
+    if alignments is not None:
+        if isinstance(alignments, dict):    # after beautify: triple -> 'token-offset'
+            rec['alignments'] = sorted([_json_value(x), _json_value(r), _json_value(y), tok] for (x,r,(y,)),tok in alignments.items())
+            rec['_alignmentsRepr'] = repr(alignments)
+        else:
+            rec['alignments'] = sorted([_json_value(v), t] for v,t in alignments[:])
+            rec['_alignmentsRepr'] = repr(alignments)
+    return rec
+
+class Writer(object):
+    '''Base class: collects output text and writes it to the stream in blocks.'''
+    def __init__(self, stream):
+        self._stream = stream
+        self._buf = []
+        self._size = 0
+
+    def _write(self, s):
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        self._buf.append(s)
+        self._size += len(s)
+        if self._size>=BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        self._stream.write(''.join(self._buf))
+        self._stream.flush()
+        self._buf = []
+        self._size = 0
+
+    def close(self):
+        self.flush()
+        if self._stream not in (sys.stdout, sys.stderr):
+            self._stream.close()
+
+class PenmanWriter(Writer):
+    def __init__(self, stream, showSentence=True):
+        Writer.__init__(self, stream)
+        self.showSentence = showSentence
+
+    def write(self, rec, timer=None):
+        if self.showSentence:
+            self._write(rec['id']+'\n')
+            if rec['sentence'] is not None:
+                self._write(rec['sentence']+'\n\n')
+        self._write(rec['amr']+'\n\n')
+        if '_alignmentsRepr' in rec:
+            self._write(rec['_alignmentsRepr']+'\n\n')
+
+class JsonlWriter(Writer):
+    def write(self, rec, timer=None):
+        rec = OrderedDict((k,v) for k,v in rec.items() if not k.startswith('_'))
+        if timer is not None:
+            rec['timing'] = OrderedDict((name, wall) for name,wall,cpu in timer.steps)
+        self._write(json.dumps(rec)+'\n')
+
+def open_writer(path, format=None, showSentence=True):
+    '''
+    Opens a writer for 'path' ('-' for stdout). The format is 'penman' or 'jsonl'
+    (by default, jsonl if the file name contains .jsonl).
+    '''
+    if format is None:
+        format = 'jsonl' if '.jsonl' in path else 'penman'
+    if path=='-':
+        stream = sys.stdout
+    elif path.endswith('.gz'):
+        import gzip
+        stream = gzip.open(path, 'wb')
+    else:
+        stream = open(path, 'wb')
+    if format=='jsonl':
+        return JsonlWriter(stream)
+    elif format=='penman':
+        return PenmanWriter(stream, showSentence)
+    raise ValueError('Unknown output format: '+format)
+
+class Progress(object):
+    '''Reports progress on stderr at most once per 'interval' seconds
+    (every sentence if 0), with throughput and (if the total is known) time remaining.'''
+    def __init__(self, total=None, interval=1.0, out=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.out = out
+        self._start = self._last = time.time()
+        self._line = None
+
+    def update(self, nDone, nSuccess, nConnected):
+        now = time.time()
+        self._line = (nDone, nSuccess, nConnected)
+        if now-self._last>=self.interval:
+            self._last = now
+            self._report(now)
+            self._line = None
+
+    def finish(self):
+        if self._line is not None:
+            self._report(time.time())
+
+    def _report(self, now):
+        nDone, nSuccess, nConnected = self._line
+        msg = '{}/{}, {} succeeded without exceptions ({} connected)'.format(nDone, '?' if self.total is None else self.total, nSuccess, nConnected)
+        if self.interval>0 and now>self._start:
+            rate = nDone/(now-self._start)
+            msg += ', {:.1f} sentences/s'.format(rate)
+            if self.total is not None and nDone<self.total and rate>0:
+                eta = int((self.total-nDone)/rate)
+                msg += ', ETA {}:{:02d}:{:02d}'.format(eta//3600, eta//60%60, eta%60)
+        print(msg, file=self.out)
@@ -3,68 +3,149 @@
 Driver and utilities for English-to-AMR pipeline.
 '''
 from __future__ import print_function
-import os, sys, re, codecs, fileinput, json, glob, time, traceback
+import os, sys, re, codecs, fileinput, json, glob, time, traceback, signal, threading
 
-from collections import defaultdict
+if __name__=='__main__' and '--startup-report' in sys.argv:
+    import startup
+    startup.install()
 
-import config
+from collections import defaultdict, OrderedDict, deque
+
+import config, timing, budget, stages, output
+from corpus import SentenceRecord, iter_sentences, is_shard, is_archive, wsj_sort
 
 from dev.amr.amr import Amr
 from alignment import Alignment
-from add_prop import SpanTree, span_from_treepos
+from completion import Completed
+from sentindex import SentenceIndex
 
 def main(files):
-    # pipeline steps
-    import nes, timex, vprop, nprop, verbalize, conjunctions, copulas, adjsAndAdverbs, auxes, misc, coref, top, beautify
-    
-    nSents = len(files)
+    nSents = None if any(is_shard(f) or is_archive(f) for f in files) else len(files)   # unknown for streamed input
     nSuccess = nConnected = 0
+    nHits = nMisses = 0
+    nAborted = 0
     iSent = 0
     
-    def wsj_sort(path):
-        m = re.search(r'wsj_(\d{4})\.(\d+)', path)
-        if not m: return 0
-        docnum, sentnum = m.groups()
-        return (int(docnum), int(sentnum))
-
-    for f in sorted(files,key=wsj_sort):
-
-        try:
-            sentenceId = os.path.basename(f).replace('.json','')
+    sentences = iter_sentences(files)
+    writer = output.open_writer(config.outputFile, config.outputFormat, config.showSentence) if config.outputFile else None
+    progress = output.Progress(nSents, config.progressInterval)
+    
+    if config.nProcesses<=1 and budget.enabled():
+        warm_up()   # (pool workers warm up in _init_worker())
+    
+    if config.nProcesses>1:
+        # fan sentences out to a pool of workers; imap() yields results in input order
+        import multiprocessing
+        pool = multiprocessing.Pool(config.nProcesses, _init_worker, (config_state(),))
+        chunksize = max(1, min(16, nSents//(4*config.nProcesses))) if nSents is not None else 8
+        throttle = _Throttle(4*config.nProcesses)
+        results = _ordered_results(pool.imap(_process_chunk, throttle.feed(_chunked(sentences, chunksize))), throttle)
+    elif config.cacheDir:
+        pool = None
+        results = (_process_captured(sentence) for sentence in sentences)
+    else:
+        pool = None
+        results = (process_sentence(sentence)+(None,False,None) for sentence in sentences)
+    
+    report = timing.TimingReport() if config.timingReport else None
+    
+    try:
+        for success, connected, timer, aborted, record, captured, fatal, cached in results:
+            if captured is not None:
+                _replay(captured)
+            if fatal:   # the worker hit an exception outside of error-tolerant mode (traceback already replayed)
+                sys.exit(1)
+            if writer is not None:
+                writer.write(record, timer)
+            if report is not None and timer is not None:    # cache hits are not timed
+                report.add(timer.sentenceId, timer.steps)
+            if cached is not None:
+                nHits += cached
+                nMisses += not cached
             
-            if config.showSentence:
-                print(sentenceId)
-        
-            # load dependency parse from sentence file
-            tokens, ww, wTags, depParse = loadDepParse(f)
-
-            # initialize input to first pipeline step
-            token_accounted_for = [False]*len(depParse)
-            '''Has the token been accounted for yet in the semantics?'''
-        
-            edge_accounted_for = {(dep['gov_idx'],m): False for m in range(len(depParse)) if depParse[m] for dep in depParse[m]}
-            '''Has the dependency edge been accounted for yet in the semantics?'''
+            nSuccess += success
+            nConnected += connected
+            nAborted += aborted is not None
+            iSent += 1
+            progress.update(iSent, nSuccess, nConnected)
+    except:
+        if pool is not None:
+            throttle.cancel()
+            pool.terminate()
+        raise
+    finally:
+        if writer is not None:
+            writer.close()
+    
+    progress.finish()
+    if pool is not None:
+        pool.close()
+        pool.join()    # lets workers exit normally, dumping any profiles
+    elif config.profileDir:
+        timing.dump_profiles()
+    if report is not None:
+        report.write(config.timingReport)
+    if nAborted:
+        print('{} sentences aborted for exceeding their budget'.format(nAborted), file=sys.stderr)
+    if config.cacheDir:
+        print('cache: {} hits, {} misses'.format(nHits, nMisses), file=sys.stderr)
+        if config.cacheSize is not None:
+            import cache
+            cache.ResultCache(config.cacheDir).prune(config.cacheSize*2**20)
+
+def process_sentence(sentence):
+    '''
+    Runs all pipeline steps on the SentenceRecord 'sentence', printing the resulting AMR 
+    (and alignments, if requested) to stdout.
+    (With config.outputFile, the output is returned as a record for the writer instead.)
+    @return: (success, connected, timer, aborted, record), where 'success' is True if no module raised 
+    an exception, 'connected' is True if the AMR was connected without a dummy top node, 
+    'timer' holds (name, wall time, CPU time) for each timed step (None unless timing/profiling), 
+    'aborted' is the reason the sentence was abandoned for exceeding its budget, if it was, 
+    and 'record' is the output record (see output.make_record()), if there is an output file
+    '''
+    pipelineSteps = stages.modules(config.stages)
     
-            completed = token_accounted_for, edge_accounted_for
+    success = connected = False
+    aborted = record = None
+    timer = timing.SentenceTimer(sentence.sentenceId) if config.timingReport or config.profileDir else None
     
+    try:
+        sentenceId = sentence.sentenceId
+        
+        if config.showSentence and not config.outputFile:
+            print(sentenceId)
+    
+        # budget aborts are raised from the load step and the pipeline steps only, not while printing
+        with budget.Budget() as limits:
+            with timing.timed(timer, 'load'):
+                # load dependency parse from sentence file
+                tokens, ww, wTags, depParse = loadDepParse(sentence)
+                sentence.index = SentenceIndex(depParse)
+
+                # initialize input to first pipeline step:
+                # has each token and dependency edge been accounted for yet in the semantics?
+                completed = Completed.from_dep_parse(depParse)
+
             amr = Amr()
             alignments = Alignment()
-    
+
             # serially execute pipeline steps
-            
+        
             # the sentence
-            if config.showSentence:
+            if config.showSentence and not config.outputFile:
                 print(' '.join(filter(None,ww)))
                 print()
                 sys.stdout.flush()
 
             hasModuleException = False
-            for m in [nes, timex, vprop, nprop, verbalize, conjunctions, copulas, adjsAndAdverbs, auxes, misc, coref, top, beautify]:
+            for m in pipelineSteps:
                 if config.verbose:
                     print('\n\nSTAGE: ', m.__name__, '...', file=sys.stderr)
-                    
+                
                 try:
-                    depParse, amr, alignments, completed = m.main(sentenceId, f, tokens, ww, wTags, depParse, amr, alignments, completed)
+                    with limits.stage(m.__name__), timing.timed(timer, m.__name__):
+                        depParse, amr, alignments, completed = m.main(sentenceId, sentence, tokens, ww, wTags, depParse, amr, alignments, completed)
                 except Exception as ex:
                     hasModuleException = True
                     if not config.errorTolerant:
@@ -72,52 +153,213 @@ def main(files):
                     print('EXCEPTION IN', m.__name__, 'MODULE\n', file=sys.stderr)
                     print(sentenceId, file=sys.stderr)
                     traceback.print_exception(*sys.exc_info())
-                
+            
                 if config.verbose:
                     print(repr(amr), file=sys.stderr)
                     print('Completed:',[depParse[i][0]['dep'] for i,v in enumerate(completed[0]) if v and depParse[i]], file=sys.stderr)
                     print(alignments, [deps[0]['dep'] for deps in depParse if deps and not completed[0][deps[0]['dep_idx']]], file=sys.stderr)
                     print(amr, file=sys.stderr)
-                
-            if config.verbose:
-                print(' '.join(tokens), file=sys.stderr)
+            
+        if config.verbose:
+            print(' '.join(tokens), file=sys.stderr)
 
+        with timing.timed(timer, 'print'):
             if amr.is_connected(warn=None):
-                nConnected += 1
+                connected = True
             else:
                 # insert dummy top node, called 'and' for now. remove :-DUMMY triples for (former) orphans.
                 amr = new_amr_from_old(amr, new_triples=[('top','opX',v) for v in amr.roots], new_concepts={'top': 'and'}, avoid_triples=[(x,r,(y,)) for x,r,(y,) in amr.triples(instances=False) if r=='-DUMMY'])
 
-            print(amr)
-            #amr.render()
-            #print('Amr.from_triples(',amr.triples(instances=False),',',amr.node_to_concepts,')')
-            print()
-            if config.alignments:
-                print(alignments)
+            if config.outputFile:
+                record = output.make_record(sentenceId, ww, amr, alignments if config.alignments else None)
+            else:
+                print(amr)
+                #amr.render()
+                #print('Amr.from_triples(',amr.triples(instances=False),',',amr.node_to_concepts,')')
                 print()
+                if config.alignments:
+                    print(alignments)
+                    print()
+
+        if config.verbose or config.showRemainingDeps:
+            print('\n\nRemaining edges:', file=sys.stderr)
+            remaining = set(completed[1].remaining())
+            for m in sorted(set(m for h,m in remaining)):
+                for dep in depParse[m] or []:
+                    if dep['gov_idx'] is not None and (dep['gov_idx'],dep['dep_idx']) in remaining:
+                        print((dep['gov']+'-'+str(dep['gov_idx']),dep['rel'],dep['dep']+'-'+str(dep['dep_idx'])), file=sys.stderr)
+
+        if not hasModuleException:
+            success = True
+
+        
+    except budget.BudgetExceeded as ex:  # only in error-tolerant mode
+        aborted = ex.reason()
+        record = _empty_output(sentenceId)
+        print(json.dumps(OrderedDict([('sentence', sentenceId)]+sorted(aborted.items()))), file=sys.stderr)
+    except Exception as ex:
+        if not config.errorTolerant:
+            raise
+        record = _empty_output(sentenceId)
+        print(sentenceId, file=sys.stderr)
+        traceback.print_exception(*sys.exc_info())
+        time.sleep(0)
+    finally:
+        sentence.index = None
     
-            if config.verbose or config.showRemainingDeps:
-                print('\n\nRemaining edges:', file=sys.stderr)
-                for deps in depParse:
-                    if deps is None: continue
-                    for dep in deps:
-                        if dep['gov_idx'] is not None and not completed[1][(dep['gov_idx'],dep['dep_idx'])]:
-                            print((dep['gov']+'-'+str(dep['gov_idx']),dep['rel'],dep['dep']+'-'+str(dep['dep_idx'])), file=sys.stderr)
+    return success, connected, timer, aborted, record
 
-            if not hasModuleException:
-                nSuccess += 1
+def _empty_output(sentenceId):
+    '''Outputs (x1 / amr-empty) for a sentence that could not be processed.
+    @return: the output record, if output goes to a writer'''
+    if config.outputFile:
+        return output.make_record(sentenceId)
+    print(output.EMPTY_AMR+'\n')
 
-            
-        except Exception as ex:
-            if not config.errorTolerant:
-                raise
-            print('(x1 / amr-empty)\n')
-            print(sentenceId, file=sys.stderr)
-            traceback.print_exception(*sys.exc_info())
-            time.sleep(0)
-            
-        iSent += 1
-        print('{}/{}, {} succeeded without exceptions ({} connected)'.format(iSent, nSents, nSuccess, nConnected), file=sys.stderr)
+def config_state():
+    '''Snapshot of the settings in the config module, for transfer to worker processes.'''
+    return {k: v for k,v in vars(config).items() if not k.startswith('_')}
+
+def warm_up():
+    '''
+    Imports all pipeline steps and loads the lexicons they share across sentences.
+    Called before the first sentence when budgets are enforced, so that a budget
+    cannot run out in the middle of a one-time load (and charge it to one sentence).
+    An interrupted load is retried by the next sentence:
+
+    >>> import verbalize, contextlib, StringIO
+    >>> def run(sentence):  # the printed AMR and the abort reason, if any
+    ...     stdout, stderr = sys.stdout, sys.stderr
+    ...     sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+    ...     try:
+    ...         aborted = process_sentence(sentence)[3]
+    ...         return sys.stdout.getvalue(), aborted
+    ...     finally:
+    ...         sys.stdout, sys.stderr = stdout, stderr
+    >>> first, later = iter_sentences(['examples/wsj_0002.0.json', 'examples/wsj_0001.0.json'])
+    >>> expected = run(later)
+    >>> @contextlib.contextmanager
+    ... def interrupted(path):  # the budget runs out early in the lexicon file
+    ...     lines = list(open(path))
+    ...     def read():
+    ...         for ln in lines[:100]: yield ln
+    ...         raise budget.BudgetExceeded('time', 'stage', 'verbalize', 1, 1)
+    ...     yield read()
+    >>> verbalize._npred2vpred, verbalize.open = {}, interrupted
+    >>> run(first)[1]['stage']
+    'verbalize'
+    >>> del verbalize.open
+    >>> run(later)==expected
+    True
+    '''
+    stages.modules()
+    import verbalize, adjsAndAdverbs
+    verbalize.nompred2verbpred('')
+    adjsAndAdverbs.simplify_adv('')
+
+def _init_worker(state):
+    for k,v in state.items():
+        setattr(config, k, v)
+    if budget.enabled():
+        warm_up()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # let the parent process handle Ctrl-C
+    if config.profileDir:   # each worker writes its own profiles when the pool is shut down
+        import multiprocessing.util
+        multiprocessing.util.Finalize(None, timing.dump_profiles, args=(str(os.getpid()),), exitpriority=10)
+
+class _Capture(object):
+    '''Stand-in for sys.stdout/sys.stderr that records the written chunks, 
+    so they can be replayed in order by the parent process.'''
+    def __init__(self, chunks, stream):
+        self._chunks = chunks
+        self._stream = stream
+    def write(self, s):
+        self._chunks.append((self._stream, s))
+    def flush(self):
+        pass
+
+def _process_captured(sentence):
+    '''Worker entry point: runs process_sentence() with output captured, 
+    or replays the stored output from the result cache, if enabled.
+    @return: (success, connected, timer, aborted, record, captured output, fatal, cached), 
+    where 'cached' is None if there is no cache, otherwise whether the result was a cache hit'''
+    resultCache = key = None
+    if config.cacheDir:
+        import cache
+        resultCache = cache.ResultCache(config.cacheDir)
+        key = resultCache.key(sentence)
+        hit = resultCache.get(key)
+        if hit is not None:
+            success, connected, record, captured = hit
+            return success, connected, None, None, record, captured, False, True
+    
+    captured = []
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _Capture(captured, 1), _Capture(captured, 2)
+    try:
+        success, connected, timer, aborted, record = process_sentence(sentence)
+        fatal = False
+    except Exception:
+        # outside of error-tolerant mode: report the traceback via the parent, which aborts the run
+        success = connected = False
+        timer = aborted = record = None
+        fatal = True
+        traceback.print_exception(*sys.exc_info())
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+    if resultCache is not None and not fatal and aborted is None:
+        resultCache.put(key, (success, connected, record, captured))
+    return success, connected, timer, aborted, record, captured, fatal, (False if resultCache else None)
+
+def _process_chunk(chunk):
+    return [_process_captured(sentence) for sentence in chunk]
+
+def _replay(captured):
+    for stream, s in captured:
+        (sys.stdout if stream==1 else sys.stderr).write(s)
+
+def _chunked(items, n):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk)==n:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class _Throttle(object):
+    '''
+    Bounds the number of chunks handed to the pool but not yet consumed by the 
+    parent process: Pool.imap() drains its input iterable eagerly, 
+    which would otherwise read a streamed corpus into memory all at once.
+    '''
+    def __init__(self, n):
+        self._slots = threading.Semaphore(n)
+        self._cancelled = False
+    def feed(self, chunks):
+        for chunk in chunks:
+            self._slots.acquire()
+            if self._cancelled:
+                return
+            yield chunk
+    def done(self):
+        self._slots.release()
+    def cancel(self):
+        self._cancelled = True
+        self._slots.release()   # wake up the pool's task feeder thread, if waiting
+
+def _ordered_results(it, throttle):
+    '''Iterates over the per-sentence results in a Pool.imap() iterator of chunks. 
+    (Waiting with a timeout keeps the main process responsive to KeyboardInterrupt in Python 2.)'''
+    while True:
+        try:
+            chunk = it.next(0xFFFF)
+        except StopIteration:
+            return
+        throttle.done()
+        for result in chunk:
+            yield result
 
 def token2concept(t, normalize_pronouns=True):
     t = t.replace('$', '-DOLLAR-').replace('&', 'and')
@@ -134,187 +376,186 @@ def token2concept(t, normalize_pronouns=True):
     return res
 
 
-def loadBBN(jsonFile):
-    with codecs.open(jsonFile, 'r', 'utf-8') as jsonF:
-        return json.load(jsonF)['bbn_ne']
-
-def loadVProp(jsonFile):
-    with codecs.open(jsonFile, 'r', 'utf-8') as jsonF:
-        data = json.load(jsonF)
-        props = [prop for prop in data["prop"] if prop["frame"]!='do.01']   # auxiliary do.01 shouldn't be annotated, but sometimes is
-        return props
-
-def loadNProp(jsonFile):
-    with codecs.open(jsonFile, 'r', 'utf-8') as jsonF:
-        return json.load(jsonF)['nom']
-
-def loadTimex(jsonFile):
-    with codecs.open(jsonFile, 'r', 'utf-8') as jsonF:
-        return json.load(jsonF)['timex']
-
-def loadDepParse(jsonFile):
-    with codecs.open(jsonFile, 'r', 'utf-8') as jsonF:
-        sentJ = json.load(jsonF)
-
-        # words
-        tokens = sentJ["treebank_sentence"].split() # includes traces
-        ww = [None]*len(tokens)
-        wTags = [None]*len(tokens)
-        for itm in sentJ["words"]:
-            ww[itm[1]["idx"]] = itm[0]
-            wTags[itm[1]["idx"]] = itm[1]
-
-        # dependency parse
-        deps = [None]*len(tokens)   # entries that will remain None: dependency root, punctuation, or function word incorporated into a dependecy relation
-        deps_concise = sentJ["stanford_dep"]
-        for entry in deps_concise:
-            i = entry["dep_idx"]
-            if deps[i] is None:
-                deps[i] = []
-            if entry["gov_idx"]==-1:    # root
-                entry["gov_idx"] = None
-            deps[i].append(entry)  # can be multiple entries for a token, because tokens can have multiple heads
-
-
-        mark_depths(deps)
-
-        # dependency parse: un-collapse coordinate structures except for amod links
-        conjs = [d for dep in deps if dep for d in dep if d["rel"].startswith('conj_')]
-        if conjs:
-            if config.verbose:
-                print('resolving coordination...', file=sys.stderr)
-            #print(tokens)
-            ccs = [dep for dep in sentJ["stanford_dep_basic"] if dep["rel"]=='cc']
-            
+def loadBBN(sentence):
+    return sentence.bbn_ne
+
+def loadVProp(sentence):
+    props = [prop for prop in sentence.prop if prop["frame"]!='do.01']   # auxiliary do.01 shouldn't be annotated, but sometimes is
+    return props
+
+def loadNProp(sentence):
+    return sentence.nom
+
+def loadTimex(sentence):
+    return sentence.timex
+
+def loadDepParse(sentence):
+    sentJ = sentence.data
+
+    # words
+    tokens = sentJ["treebank_sentence"].split() # includes traces
+    ww = [None]*len(tokens)
+    wTags = [None]*len(tokens)
+    for itm in sentJ["words"]:
+        ww[itm[1]["idx"]] = itm[0]
+        wTags[itm[1]["idx"]] = itm[1]
+
+    # dependency parse
+    deps = [None]*len(tokens)   # entries that will remain None: dependency root, punctuation, or function word incorporated into a dependecy relation
+    deps_concise = sentJ["stanford_dep"]
+    for entry in deps_concise:
+        i = entry["dep_idx"]
+        if deps[i] is None:
+            deps[i] = []
+        if entry["gov_idx"]==-1:    # root
+            entry["gov_idx"] = None
+        deps[i].append(entry)  # can be multiple entries for a token, because tokens can have multiple heads
+
+
+    mark_depths(deps)
+
+    # dependency parse: un-collapse coordinate structures except for amod links
+    conjs = [d for dep in deps if dep for d in dep if d["rel"].startswith('conj_')]
+    if conjs:
+        if config.verbose:
+            print('resolving coordination...', file=sys.stderr)
+        #print(tokens)
+        # index the basic dependencies by (dependent, governor), and the cc links by governor
+        basicdeps = defaultdict(list)
+        ccs = defaultdict(list)
+        for dep in sentJ["stanford_dep_basic"]:
+            basicdeps[(dep["dep_idx"],dep["gov_idx"])].append(dep)
+            if dep["rel"]=='cc':
+                ccs[dep["gov_idx"]].append(dep)
         
-        # account for coordinations with >2 conjuncts: group together  
-        # under the head of the coordinate structure (one of the conjuncts)
-        conjgroups = defaultdict(lambda: [set(), set()])
-        for conj in conjs:
-            i, r, h = conj["dep_idx"], conj["rel"], conj["gov_idx"]
-            if [dep for dep in sentJ["stanford_dep_basic"] if dep["dep_idx"]==i and dep["gov_idx"]==h and dep["rel"]=='conj']:
-                conjgroups[(h,r)][0].add(i)
-            else:   # i is a modifier of the whole coordinate phrase. see comment below for an example.
-                conjmodifiers = [dep for dep in sentJ["stanford_dep_basic"] if dep["dep_idx"]==i and dep["gov_idx"]==h]
-                assert len(conjmodifiers)==1
-                conjmodifier = conjmodifiers[0]
-                # remove the 'conj' edge from the collapsed parse
-                deps[conjmodifier["dep_idx"]] = [dep for dep in deps[conjmodifier["dep_idx"]] if dep["gov_idx"]!=h]
-                conjgroups[(h,r)][1].add((conjmodifier["dep_idx"], conjmodifier["rel"]))
+    
+    # account for coordinations with >2 conjuncts: group together  
+    # under the head of the coordinate structure (one of the conjuncts)
+    conjgroups = defaultdict(lambda: [set(), set()])
+    for conj in conjs:
+        i, r, h = conj["dep_idx"], conj["rel"], conj["gov_idx"]
+        if any(dep["rel"]=='conj' for dep in basicdeps[(i,h)]):
+            conjgroups[(h,r)][0].add(i)
+        else:   # i is a modifier of the whole coordinate phrase. see comment below for an example.
+            conjmodifiers = basicdeps[(i,h)]
+            assert len(conjmodifiers)==1
+            conjmodifier = conjmodifiers[0]
+            # remove the 'conj' edge from the collapsed parse
+            deps[conjmodifier["dep_idx"]] = [dep for dep in deps[conjmodifier["dep_idx"]] if dep["gov_idx"]!=h]
+            conjgroups[(h,r)][1].add((conjmodifier["dep_idx"], conjmodifier["rel"]))
+    
+    restructured = False    # depths are re-marked once all coordinate structures have been converted
+    for (h,r),(ii,mm) in sorted(conjgroups.items(), key=lambda ((h,r),ii): deps[h][0]["depth"]):
+        assert h>0
+        # find the collapsed dependencies, i.e. the (non-conjunction) links shared 
+        # by all conjuncts. start with higher nodes in the tree in case there are 
+        # coordinations embedded within coordinations (cf. wsj_0003.25).
+        isharedheads = {g: gdep for g,gdep in parent_deps(deps[h]) if all(g in parents(deps[i]) for i in ii)}
+        if None in parents(deps[h]):  # h is the root token
+            assert not isharedheads
+            isharedheads = {None: dict(parent_deps(deps[h]))[None]}
+        else:
+            assert isharedheads,((ww[h],parents(deps[h]),r),[(ww[i],parents(deps[i])) for i in ii])
         
-        for (h,r),(ii,mm) in sorted(conjgroups.items(), key=lambda ((h,r),ii): deps[h][0]["depth"]):
-            assert h>0
-            # find the collapsed dependencies, i.e. the (non-conjunction) links shared 
-            # by all conjuncts. start with higher nodes in the tree in case there are 
-            # coordinations embedded within coordinations (cf. wsj_0003.25).
-            isharedheads = {g: gdep for g,gdep in parent_deps(deps[h]) if all(g in parents(deps[i]) for i in ii)}
-            if None in parents(deps[h]):  # h is the root token
-                assert not isharedheads
-                isharedheads = {None: dict(parent_deps(deps[h]))[None]}
-            else:
-                assert isharedheads,((ww[h],parents(deps[h]),r),[(ww[i],parents(deps[i])) for i in ii])
-            
-            # special treatment for and-ed adjectival modifiers
-            if r=='conj_and':
-                amodConj = False
-                for g,gdep in isharedheads.items():
-                    if gdep["rel"]=='amod':  # remove the conjunction link(s)
-                        amodConj = True
-                        for i in ii:
-                            if config.verbose: print('  removing',r,'link (gov',h,', dep',i,')', file=sys.stderr)
-                            deps[i] = [d for d in deps[i] if d["rel"]!=r]
-                        break
-                if amodConj:
-                    continue
-            
-            # everything else: undo propagation of conjunct dependencies
-            
-            
-            # 1. remove the non-conjunction link sharing a dependent with the conjunction link
-            # example from wsj_0020.0: "removed Korea and Taiwan" transformed from
-            #    removed <-dobj- Korea <-conj_and- Taiwan
-            #        ^-------------------------dobj---|
-            #  to
-            #    removed         Korea <-conj_and- Taiwan
-            # (Korea is h, Taiwan is its dependent i, removed is the shared head)
-            
-            for isharedhead in isharedheads:
-                for i in {h} | ii:
-                    if config.verbose: print('  removing any links with (gov',isharedhead,', dep',i,')', file=sys.stderr)
-                    deps[i] = [d for d in deps[i] if d["gov_idx"]!=isharedhead]
-            
-            # 2. then use Basic Dependencies to convert to
-            #    removed <-dobj- and <-conj- Korea
-            #                     ^----conj- Taiwan
-            
-            # - get the coordinating conjunction (call its index c)
-            ccdeps = [dep for dep in ccs if dep["gov_idx"]==h]
-            assert len(ccdeps)==1
-            cc = ccdeps[0]
-            c, cword = cc["dep_idx"], cc["dep"]
-            if deps[c] is None: deps[c] = []
-            
-            # conjmodifiers: anything that modifies the head conjunct with type conj_* in the collapsed parse 
-            # but another type (such as advmod) in the basic parse is a modifier of the entire coordinate phrase.
-            # therefore, attach to the coordinating conjunction.
-            # arises in wsj_0003.25 ('dumped..., poured... and mechanically mixed': 'mechanically' is converted to 
-            # an advmod of the whole phrase, which is probably not correct but would be a valid interpretation if 
-            # the word order were slightly different).
-            for (imod,modrel) in mm:
-                deps[imod].append({"gov_idx": c, "gov": cword, "dep_idx": imod, "dep": ww[imod], "rel": modrel})
-            
-            # - link coordinating conjunction to the shared heads, in place of h
-            for isharedhead,sharedheaddep in isharedheads.items():
-                deps[c].append({"gov_idx": sharedheaddep["gov_idx"], "gov": sharedheaddep["gov"], "dep_idx": c, "dep": cword, "rel": sharedheaddep["rel"]})
-                deps[h].append({"gov_idx": c, "gov": cword, "dep_idx": h, "dep": ww[h], "rel": 'conj'})
-                for i in ii:
-                    deps[i].append({"gov_idx": c, "gov": cword, "dep_idx": i, "dep": ww[i], "rel": 'conj'})
-
-            # 3. Remove conj_* links
+        # special treatment for and-ed adjectival modifiers
+        if r=='conj_and':
+            amodConj = False
+            for g,gdep in isharedheads.items():
+                if gdep["rel"]=='amod':  # remove the conjunction link(s)
+                    amodConj = True
+                    for i in ii:
+                        if config.verbose: print('  removing',r,'link (gov',h,', dep',i,')', file=sys.stderr)
+                        deps[i] = [d for d in deps[i] if d["rel"]!=r]
+                    break
+            if amodConj:
+                continue
+        
+        # everything else: undo propagation of conjunct dependencies
+        
+        
+        # 1. remove the non-conjunction link sharing a dependent with the conjunction link
+        # example from wsj_0020.0: "removed Korea and Taiwan" transformed from
+        #    removed <-dobj- Korea <-conj_and- Taiwan
+        #        ^-------------------------dobj---|
+        #  to
+        #    removed         Korea <-conj_and- Taiwan
+        # (Korea is h, Taiwan is its dependent i, removed is the shared head)
+        
+        for isharedhead in isharedheads:
+            for i in {h} | ii:
+                if config.verbose: print('  removing any links with (gov',isharedhead,', dep',i,')', file=sys.stderr)
+                deps[i] = [d for d in deps[i] if d["gov_idx"]!=isharedhead]
+        
+        # 2. then use Basic Dependencies to convert to
+        #    removed <-dobj- and <-conj- Korea
+        #                     ^----conj- Taiwan
+        
+        # - get the coordinating conjunction (call its index c)
+        ccdeps = ccs[h]
+        assert len(ccdeps)==1
+        cc = ccdeps[0]
+        c, cword = cc["dep_idx"], cc["dep"]
+        if deps[c] is None: deps[c] = []
+        
+        # conjmodifiers: anything that modifies the head conjunct with type conj_* in the collapsed parse 
+        # but another type (such as advmod) in the basic parse is a modifier of the entire coordinate phrase.
+        # therefore, attach to the coordinating conjunction.
+        # arises in wsj_0003.25 ('dumped..., poured... and mechanically mixed': 'mechanically' is converted to 
+        # an advmod of the whole phrase, which is probably not correct but would be a valid interpretation if 
+        # the word order were slightly different).
+        for (imod,modrel) in mm:
+            deps[imod].append({"gov_idx": c, "gov": cword, "dep_idx": imod, "dep": ww[imod], "rel": modrel})
+        
+        # - link coordinating conjunction to the shared heads, in place of h
+        for isharedhead,sharedheaddep in isharedheads.items():
+            deps[c].append({"gov_idx": sharedheaddep["gov_idx"], "gov": sharedheaddep["gov"], "dep_idx": c, "dep": cword, "rel": sharedheaddep["rel"]})
+            deps[h].append({"gov_idx": c, "gov": cword, "dep_idx": h, "dep": ww[h], "rel": 'conj'})
             for i in ii:
-                if config.verbose: print('  removing any conj_* links with (gov',h,', dep',i,')', file=sys.stderr)
-                deps[i] = [d for d in deps[i] if d["gov_idx"]!=h or not d["rel"].startswith('conj_')]
+                deps[i].append({"gov_idx": c, "gov": cword, "dep_idx": i, "dep": ww[i], "rel": 'conj'})
 
-            clear_depths(deps)
-            mark_depths(deps)
+        # 3. Remove conj_* links
+        for i in ii:
+            if config.verbose: print('  removing any conj_* links with (gov',h,', dep',i,')', file=sys.stderr)
+            deps[i] = [d for d in deps[i] if d["gov_idx"]!=h or not d["rel"].startswith('conj_')]
+        restructured = True
 
-        return tokens, ww, wTags, deps  # ww and wTags have None for tokens which are empty elements
+    if restructured:
+        clear_depths(deps)
+        mark_depths(deps)
+
+    return tokens, ww, wTags, deps  # ww and wTags have None for tokens which are empty elements
 
 def surface2treeToken(offset, ww):
     '''
     Given a token offset in the (tokenized) surface sentence,
     convert to a tree token offset by accounting for empty elements/traces.
     ''' # TODO: replace with preprocessing of json files
-    i = offset
-    while i-ww[:i].count(None)<offset:
+    i = n = 0   # n: number of surface tokens before i
+    while n<offset:
+        n += ww[i] is not None
         i += 1
     return i
 
-def loadCoref(jsonFile, ww):
-    with codecs.open(jsonFile, 'r', 'utf-8') as jsonF:
-        chains = json.load(jsonF)["coref_chains"]
-        coref = {}  # coref chain ID -> set of elements
-        for start,end,chainId,w in chains:
-            coref.setdefault(chainId,set()).add((start,end,w))
-            
-        # TODO: some of the chains have overlapping members. requires further investigation, but for now just choose one of them.
-        for chainId,chain in coref.items():
-            itms = list(sorted(chain, key=lambda itm: itm[0]))  # sort by start index
-            groups = [0] # group members of the chain that overlap
-            for itm,pitm in zip(itms[1:],itms[:-1]):
-                if itm[0]<=pitm[1]: # overlap
-                    groups.append(groups[-1])
-                else:
-                    groups.append(groups[-1]+1) # new group
-            for ig in range(groups[-1]+1):
-                g = [itms[j] for j,i in enumerate(groups) if i==ig]
-                if len(g):
-                    choice = max(g, key=lambda itm: (itm[1], itm[1]-itm[0])) # choose the one that ends last, with the length as tiebreaker
-                    for itm in g:
-                        if itm!=choice:
-                            chain.remove(itm)   # remove non-chosen members of the group
-            
-        return coref
+def loadCoref(sentence, ww):
+    chains = sentence.coref_chains
+    coref = {}  # coref chain ID -> set of elements
+    for start,end,chainId,w in chains:
+        coref.setdefault(chainId,set()).add((start,end,w))
+        
+    # TODO: some of the chains have overlapping members. requires further investigation, but for now just choose one of them.
+    for chainId,chain in coref.items():
+        itms = sorted(chain, key=lambda itm: itm[0])  # sort by start index
+        g = []  # current group of members of the chain that overlap
+        for itm in itms+[None]:
+            if g and (itm is None or itm[0]>g[-1][1]):   # no overlap with the previous member: the group is complete
+                choice = max(g, key=lambda itm: (itm[1], itm[1]-itm[0])) # choose the one that ends last, with the length as tiebreaker
+                for gitm in g:
+                    if gitm!=choice:
+                        chain.remove(gitm)   # remove non-chosen members of the group
+                g = []
+            g.append(itm)
+        
+    return coref
 
 def parents(depParseEntry):
     return [dep["gov_idx"] for dep in depParseEntry] if depParseEntry else []
@@ -361,9 +602,9 @@ def mark_depths(depParse):
     assert len(roots)==1,roots
     
     def bfs(root, d=0):
-        queue = [(root,d)]
+        queue = deque([(root,d)])
         while queue:
-            h, d = queue.pop(0)
+            h, d = queue.popleft()
             if "depth" not in depParse[h][0]:
                 for dep in depParse[h]:
                     dep["depth"] = d
@@ -396,7 +637,8 @@ def highest(tokenIndices, depParse):
 
 def new_amr(triples, concepts, roots=None):
     return Amr.from_triples(ensure_quant(triples), concepts, roots=None, 
-                            warn=(sys.stderr if config.verbose else None))  # only display AMR cycle warnings in verbose mode
+                            warn=(sys.stderr if config.verbose else None),  # only display AMR cycle warnings in verbose mode
+                            reject_cycles=config.rejectCycles)
 
 def new_amr_from_old(oldamr, new_triples=[], new_concepts={}, avoid_triples=[], avoid_concepts=[], roots=None):
     '''Triples of the form (x,r,(y,)) or (x,r,y) are accepted.'''
@@ -406,6 +648,34 @@ def new_amr_from_old(oldamr, new_triples=[], new_concepts={}, avoid_triples=[],
                     + list(ensure_quant(new_triples)),
                    newconcepts, roots=roots)
 
+def update_amr(amr, new_triples=[], avoid_triples=[]):
+    '''
+    In-place counterpart of new_amr_from_old(): modifies and returns 'amr', which ends up
+    with the same triples, roots and concepts (iterating in the same order) as the AMR that 
+    new_amr_from_old() would build, without re-adding or re-checking the existing triples.
+
+    >>> def same(triples, steps):   # whether update_amr() matches new_amr_from_old() at every step
+    ...     amr = new_amr(triples, {str(i): 'c' for i in range(10)})
+    ...     for new_triples, avoid_triples in steps:
+    ...         rebuilt = new_amr_from_old(amr, new_triples=new_triples, avoid_triples=avoid_triples)
+    ...         update_amr(amr, new_triples=new_triples, avoid_triples=avoid_triples)
+    ...         if (str(amr), amr.triples(), amr.roots) != (str(rebuilt), rebuilt.triples(), rebuilt.roots):
+    ...             return False
+    ...     return len(amr.roots) > 1
+    >>> same([('6','ARG1','7'), ('5','time','7'), ('1','mod','5'), ('0','ARG1','8')], [([('3','ARG1','8')], [])])
+    True
+    >>> same([('2','ARG1','3'), ('0','ARG1','3'), ('0','op1','2'), ('0','mod','3')], [([('1','ARG0','3')], [('0','ARG1','3')])])
+    True
+    >>> same([('0','time','4'), ('0','time','3'), ('1','mod','4'), ('0','op2','2')],
+    ...      [([('2','op2','4')], []), ([('0','mod','4')], []), ([('0','op1','3')], [('0','time','4')])])
+    True
+    '''
+    amr.update(ensure_quant(new_triples), list(ensure_quant(avoid_triples)),
+               warn=(sys.stderr if config.verbose else None), reject_cycles=config.rejectCycles)
+    # copied as new_amr_from_old() does: the copy can iterate in a different order
+    amr.node_to_concepts = {v: c for v,c in amr.node_to_concepts.items()}
+    return amr
+
 def ensure_hyper(triples):
     '''Generator over elements of triples, coercing items of the form (x,r,y) into the form (x,r,(y,)) 
     (the hyperedge-friendly representation used internally by Amr).'''
@@ -482,6 +752,8 @@ def get_or_create_concept_from_token(amr, alignment, i, depParse, wTags, complet
 if __name__=='__main__':
     args = sys.argv[1:]
     fullNombank = False # include NomBank predicate names and arguments that cannot be verbalized
+    stageNames = untilStage = None
+    startupReport = False
     while args and args[0][0]=='-':
         arg = args.pop(0)
         if arg=='-v':
@@ -492,14 +764,52 @@ if __name__=='__main__':
             config.showRemainingDeps = True
         elif arg=='-e':
             config.errorTolerant = True
+        elif arg=='--reject-cycles':
+            config.rejectCycles = True
         elif arg=='-n':
             config.fullNombank = True
         elif arg=='-a':
             config.alignments = True
         elif arg=='-S':
             config.showSentence = False
+        elif arg=='-j':
+            config.nProcesses = int(args.pop(0))
+        elif arg=='--timing':
+            config.timingReport = args.pop(0)
+        elif arg=='--profile':
+            config.profileDir = args.pop(0)
+        elif arg=='--stages':
+            stageNames = args.pop(0).split(',')
+        elif arg=='--until':
+            untilStage = args.pop(0)
+        elif arg=='--startup-report':
+            startupReport = True
+        elif arg=='--cache':
+            config.cacheDir = args.pop(0)
+        elif arg=='--output':
+            config.outputFile = args.pop(0)
+        elif arg=='--format':
+            config.outputFormat = args.pop(0)
+        elif arg=='--progress':
+            config.progressInterval = float(args.pop(0))
+        elif arg=='--time-limit':
+            config.sentenceTimeLimit = float(args.pop(0))
+        elif arg=='--stage-time-limit':
+            config.stageTimeLimit = float(args.pop(0))
+        elif arg=='--memory-limit':
+            config.memoryLimit = float(args.pop(0))
+        elif arg=='--stage-memory-limit':
+            config.stageMemoryLimit = float(args.pop(0))
+        elif arg=='--cache-size':
+            config.cacheSize = float(args.pop(0))
         else:
             assert False,'Unknown flag: '+arg
     
+    if stageNames is not None or untilStage is not None:
+        config.stages = stages.select(stageNames, untilStage)
+    if startupReport:
+        stages.modules(config.stages)
+        startup.report()
+    
     files = [f for ff in args for f in glob.glob(ff)]
     main(files)
@@ -0,0 +1,71 @@
+'''
+Per-sentence index over the dependency parse, built once after pipeline.loadDepParse()
+and shared by the pipeline steps (as sentence.index) for head and depth lookups.
+
+@see: pipeline.choose_head(), pipeline.highest()
+'''
+from __future__ import print_function
+
+class SentenceIndex(object):
+    '''
+    >>> depParse = [[{'gov_idx': 2, 'dep_idx': 0, 'depth': 1}], None, [{'gov_idx': None, 'dep_idx': 2, 'depth': 0}],
+    ...             [{'gov_idx': 4, 'dep_idx': 3, 'depth': 2}], [{'gov_idx': 2, 'dep_idx': 4, 'depth': 1}]]
+    >>> index = SentenceIndex(depParse)
+    >>> index.children[2], index.choose_head(3, 4), index.choose_head(1, 1), index.highest([0, 3, 4])
+    ([0, 4], 4, None, 0)
+    '''
+    def __init__(self, depParse):
+        self.depParse = depParse
+        self.parents = [[dep['gov_idx'] for dep in deps] if deps else [] for deps in depParse]
+        '''Head token offsets of each token (None for the root)'''
+        self.children = [[] for deps in depParse]
+        '''Dependent token offsets of each token'''
+        for i,heads in enumerate(self.parents):
+            for h in heads:
+                if h is not None and i not in self.children[h]:
+                    self.children[h].append(i)
+        self.depths = [deps[0].get('depth') if deps else None for deps in depParse]
+        '''Depth of each token in the parse, as marked by pipeline.mark_depths()'''
+        self._frontiers = {}    # (i,j) -> candidate heads of the span
+
+    def _frontier(self, i, j):
+        '''Tokens in i through j (inclusive) with a head outside the span.'''
+        frontier = self._frontiers.get((i,j))
+        if frontier is None:
+            frontier = set(range(i,j+1))
+            for itm in set(frontier):
+                assert 0<=itm<len(self.parents)
+                if all(h is not None and i<=h<=j for h in self.parents[itm]):
+                    frontier.remove(itm)
+            self._frontiers[(i,j)] = frontier
+        return frontier
+
+    def choose_head(self, i, j, fallback=None):
+        '''choose_head(range(i,j+1), depParse, fallback), computed once per span.'''
+        frontier = self._frontier(i, j)
+        if not frontier: return None    # TODO: temporary?
+        if len(frontier)>1 and fallback is not None:
+            tiebroken = fallback(set(frontier))
+            if tiebroken is not False:
+                return tiebroken
+        assert len(frontier)==1,(frontier,range(i,j+1),[self.depParse[k] for k in frontier])
+        return next(iter(frontier))
+
+    def _depth(self, i):
+        d = self.depths[i]
+        if d is None:
+            raise KeyError('depth')
+        return d
+
+    def highest(self, tokenIndices):
+        '''Like pipeline.highest(): of the given token indices, the one highest in the parse.'''
+        frontier = set(tokenIndices)
+        for itm in set(frontier):
+            assert 0<=itm<len(self.parents)
+            if not self.parents[itm]:
+                frontier.remove(itm)
+        return min(frontier, key=self._depth)
+
+if __name__=='__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python2.7
+'''
+Long-running pipeline server, which pays for startup, imports, and lexicon
+loading only once. Requests are sentence JSON records, one per line, in the
+format of corpus shards (the sentence JSON with an "id" field). Each is answered
+with one line of JSON:
+
+    {"id": ..., "output": <AMR and alignments, as printed by pipeline.py>,
+     "messages": <warnings and tracebacks>, "success": ..., "connected": ...,
+     "aborted": <null, or why the sentence exceeded its budget>}
+
+or {"error": ...} if the request could not be read.
+
+Usage:
+
+    python server.py [-w] [-e] [-n] [-a] [--reject-cycles] [-j N] [--cache DIR] [--time-limit SEC]
+        [--stage-time-limit SEC] [--memory-limit MB] [--stage-memory-limit MB] [--socket PATH]
+
+Without --socket, requests are read from stdin and answered on stdout, in order.
+With --socket, clients connect to a UNIX domain socket; connections are served
+concurrently by threads, and sentences are processed by a pool of N worker
+processes (or one at a time in the server process if N is 1).
+
+@see: pipeline.py, corpus.py
+'''
+from __future__ import print_function
+import os, sys, json, threading, multiprocessing, SocketServer
+
+import config, pipeline
+from corpus import record_from_line
+
+def _init_worker(state):
+    pipeline._init_worker(state)
+    pipeline.warm_up()
+
+def process_line(line):
+    '''Processes one request line in this process.
+    @return: the response line (without newline)'''
+    try:
+        sentence = record_from_line(line)
+    except (ValueError, KeyError) as ex:
+        return json.dumps({'error': 'invalid request: {}'.format(ex)})
+    success, connected, timer, aborted, record, captured, fatal, cached = pipeline._process_captured(sentence)
+    return json.dumps({'id': sentence.sentenceId,
+                       'output': ''.join(s for stream,s in captured if stream==1),
+                       'messages': ''.join(s for stream,s in captured if stream==2),
+                       'success': success, 'connected': connected, 'aborted': aborted})
+
+class Server(object):
+    def __init__(self, nProcesses=1):
+        if nProcesses>1:
+            self.pool = multiprocessing.Pool(nProcesses, _init_worker, (pipeline.config_state(),))
+        else:
+            self.pool = None
+            pipeline.warm_up()
+        self._lock = threading.Lock()   # output capture swaps sys.stdout, so only one sentence at a time in-process
+
+    def respond(self, line):
+        if self.pool is not None:
+            return self.pool.apply(process_line, (line,))
+        with self._lock:
+            return process_line(line)
+
+    def serve_stream(self, inF, outF):
+        '''Answers requests from 'inF' on 'outF', in order.'''
+        lines = (line for line in iter(inF.readline, '') if line.strip())   # blank lines are skipped, as on the socket
+        if self.pool is not None:   # keep all workers busy
+            responses = self.pool.imap(process_line, lines)
+        else:
+            responses = (self.respond(line) for line in lines)
+        for response in responses:
+            outF.write(response+'\n')
+            outF.flush()
+
+    def serve_socket(self, path):
+        server = self
+        class Handler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                for line in iter(self.rfile.readline, ''):
+                    if line.strip():
+                        self.wfile.write(server.respond(line)+'\n')
+                        self.wfile.flush()
+
+        if os.path.exists(path):
+            os.unlink(path)
+        sockServer = SocketServer.ThreadingUnixStreamServer(path, Handler)
+        sockServer.daemon_threads = True
+        try:
+            sockServer.serve_forever()
+        finally:
+            sockServer.server_close()
+            os.unlink(path)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+
+if __name__=='__main__':
+    args = sys.argv[1:]
+    socketPath = None
+    config.showSentence = False     # the sentence ID is part of the response
+    while args and args[0][0]=='-':
+        arg = args.pop(0)
+        if arg=='-w':
+            config.warn = True
+        elif arg=='-e':
+            config.errorTolerant = True
+        elif arg=='--reject-cycles':
+            config.rejectCycles = True
+        elif arg=='-n':
+            config.fullNombank = True
+        elif arg=='-a':
+            config.alignments = True
+        elif arg=='-j':
+            config.nProcesses = int(args.pop(0))
+        elif arg=='--cache':
+            config.cacheDir = args.pop(0)
+        elif arg=='--time-limit':
+            config.sentenceTimeLimit = float(args.pop(0))
+        elif arg=='--stage-time-limit':
+            config.stageTimeLimit = float(args.pop(0))
+        elif arg=='--memory-limit':
+            config.memoryLimit = float(args.pop(0))
+        elif arg=='--stage-memory-limit':
+            config.stageMemoryLimit = float(args.pop(0))
+        elif arg=='--socket':
+            socketPath = args.pop(0)
+        else:
+            assert False,'Unknown flag: '+arg
+    assert not args,'Unexpected arguments: '+' '.join(args)
+
+    server = Server(config.nProcesses)
+    try:
+        if socketPath:
+            server.serve_socket(socketPath)
+        else:
+            server.serve_stream(sys.stdin, sys.stdout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
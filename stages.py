@@ -0,0 +1,83 @@
+'''
+Registry of the pipeline steps. Each stage is a module with a main() function
+taking and returning the sentence's dependency parse, AMR, alignment,
+and completion flags; see pipeline.process_sentence().
+
+Stages run in the order listed in STAGES. Each declares the stages whose output
+it requires, and a selection of stages is completed with the stages it requires,
+so e.g. selecting 'beautify' also runs 'top'.
+
+@see: pipeline.py options --stages and --until
+'''
+from __future__ import print_function
+import importlib
+
+class Stage(object):
+    def __init__(self, name, requires=()):
+        self.name = name
+        self.requires = requires
+        '''Stages that must run before this one'''
+
+STAGES = [
+    Stage('nes'),
+    Stage('timex'),
+    Stage('vprop'),
+    Stage('nprop'),
+    Stage('verbalize', requires=('nprop',)),   # turns the nominal predicates from nprop into verbal ones
+    Stage('conjunctions'),
+    Stage('copulas'),
+    Stage('adjsAndAdverbs'),
+    Stage('auxes'),
+    Stage('misc'),
+    Stage('coref'),
+    Stage('top'),
+    Stage('beautify', requires=('top',)),   # roots the AMR at the concept chosen by top
+]
+
+NAMES = [stage.name for stage in STAGES]
+_BY_NAME = {stage.name: stage for stage in STAGES}
+
+def select(names=None, until=None):
+    '''
+    Names of the stages to run, in pipeline order: the stages in 'names' (default: all)
+    that come no later than 'until' (if given), plus the stages they require.
+
+    >>> select(['verbalize', 'nes'])
+    ['nes', 'nprop', 'verbalize']
+    >>> select(until='vprop')
+    ['nes', 'timex', 'vprop']
+    >>> select(['beautify', 'timex'], until='coref')
+    ['timex']
+    >>> select(['ner'])
+    Traceback (most recent call last):
+      ...
+    ValueError: Unknown stage: ner
+    '''
+    for name in list(names or [])+([until] if until else []):
+        if name not in _BY_NAME:
+            raise ValueError('Unknown stage: '+name)
+    selected = set(NAMES if names is None else names)
+    if until:
+        selected &= set(NAMES[:NAMES.index(until)+1])
+    queue = list(selected)
+    while queue:
+        for req in _BY_NAME[queue.pop()].requires:
+            if req not in selected:
+                selected.add(req)
+                queue.append(req)
+    return [name for name in NAMES if name in selected]
+
+_modules = {}
+
+def modules(names=None):
+    '''Imports the modules of the given stages (default: all).'''
+    if names is None:
+        names = NAMES
+    for name in names:
+        if name not in _modules:
+            _modules[name] = importlib.import_module(name)
+    return [_modules[name] for name in names]
+
+if __name__=='__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python2.7
+'''
+Startup cost of the pipeline: import timing and the import-time budget.
+
+pipeline.py --startup-report prints how long each module took to import
+(in the format of Python 3's -X importtime), up to and including the pipeline steps.
+Run this module as a script to check, in fresh interpreters, that importing the
+pipeline stays within IMPORT_BUDGET (exits with status 1 if it does not):
+
+    python startup.py [-n RUNS]
+
+Heavy dependencies (nltk, pyparsing, pygraphviz, xdot) are imported only
+by the code paths that need them, so they do not count against the budget.
+'''
+from __future__ import print_function
+import sys, time, __builtin__
+
+IMPORT_BUDGET = 0.1
+'''Seconds allowed for importing pipeline.py and all pipeline steps'''
+
+STARTUP_IMPORTS = 'import pipeline, stages; stages.modules()'
+
+_records = []   # (nesting depth, module name, self seconds, cumulative seconds), in order of completion
+_stack = []     # time spent in nested imports, for each import in progress
+_start = None
+_original_import = None
+
+def _timed_import(name, *args, **kwargs):
+    nModules = len(sys.modules)
+    _stack.append(0.0)
+    t = time.time()
+    try:
+        return _original_import(name, *args, **kwargs)
+    finally:
+        cumulative = time.time()-t
+        nested = _stack.pop()
+        if len(sys.modules)>nModules:   # something was actually loaded
+            _records.append((len(_stack), name, cumulative-nested, cumulative))
+            if _stack:
+                _stack[-1] += cumulative
+        elif _stack:
+            _stack[-1] += cumulative
+
+def install():
+    '''Starts timing imports.'''
+    global _original_import, _start
+    if _original_import is None:
+        _start = time.time()
+        _original_import = __builtin__.__import__
+        __builtin__.__import__ = _timed_import
+
+def report(out=sys.stderr):
+    '''Stops timing imports and prints the timings.'''
+    global _original_import
+    if _original_import is not None:
+        __builtin__.__import__ = _original_import
+        _original_import = None
+    print('import time: self [us] | cumulative | imported package', file=out)
+    for depth,name,selfTime,cumulative in _records:
+        print('import time: {:>9} | {:>10} | {}{}'.format(int(selfTime*1e6), int(cumulative*1e6), '  '*depth, name), file=out)
+    total = time.time()-_start
+    print('startup: {:.3f}s (import budget {:.3f}s{})'.format(total, IMPORT_BUDGET,
+                                                            ', EXCEEDED' if total>IMPORT_BUDGET else ''), file=out)
+
+def measure(runs=5):
+    '''Best-of-'runs' time in seconds to run STARTUP_IMPORTS in a fresh interpreter
+    (minus the time to start the interpreter itself).'''
+    import os, subprocess
+    root = os.path.dirname(os.path.abspath(__file__))
+    def best(code):
+        times = []
+        for i in range(runs):
+            t = time.time()
+            subprocess.check_call([sys.executable, '-c', code], cwd=root)
+            times.append(time.time()-t)
+        return min(times)
+    return best(STARTUP_IMPORTS)-best('pass')
+
+if __name__=='__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Check the import time of the pipeline against its budget.')
+    parser.add_argument('-n', type=int, default=5, help="number of runs (the fastest counts)")
+    args = parser.parse_args(sys.argv[1:])
+
+    t = measure(args.n)
+    print('import time: {:.3f}s (budget {:.3f}s)'.format(t, IMPORT_BUDGET))
+    sys.exit(0 if t<=IMPORT_BUDGET else 1)
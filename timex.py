@@ -5,7 +5,7 @@ from __future__ import print_function
 import os, sys, re, codecs, fileinput, json
 
 import pipeline, config
-from pipeline import choose_head, new_concept, new_concept_from_token, new_amr_from_old, parent_edges
+from pipeline import new_concept, new_concept_from_token, new_amr_from_old, parent_edges
 from xml.etree import ElementTree
 
 '''
@@ -22,15 +22,15 @@ Example input, from wsj_0002.0:
 '''
 
 
-def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, completed):
+def main(sentenceId, sentence, tokens, ww, wTags, depParse, inAMR, alignment, completed):
     amr = inAMR
     new_triples = set()
     nNewTrip = 0
 
-    time_expressions = pipeline.loadTimex(jsonFile)
+    time_expressions = pipeline.loadTimex(sentence)
     for tid, start, end, raw_timex in time_expressions:
         t = Timex3Entity(ElementTree.fromstring(raw_timex))
-        h = choose_head(range(start,end+1), depParse)
+        h = sentence.index.choose_head(start, end)
 
         mc = new_concept_from_token(amr, alignment, h, depParse, wTags, concept=pipeline.token2concept(t.main_concept))
 
@@ -64,11 +64,9 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
                 x = v
             new_triples.add((str(mc), k, x))
 
-        for i in range(start, end+1): # for now mark everything as completed
-            completed[0][i] = True
-        for i,j in completed[1]:
-            if i >= start and i <= end and j >= start and j <= end:
-                completed[1][(i,j)] = True
+        # for now mark everything as completed
+        completed[0].mark_range(start, end)
+        completed[1].mark_span(start, end)
                 
         try:
             assert t.main_concept and (t.main_concept not in ['date-entity','temporal-quantity'] or len(new_triples)>nNewTrip)
@@ -0,0 +1,120 @@
+'''
+Optional instrumentation for the pipeline driver: wall-clock and CPU time
+for each pipeline step of each sentence (plus loading and printing),
+summarized in a machine-readable report, and optionally a cProfile dump per step.
+
+@see: pipeline.py options --timing and --profile
+'''
+from __future__ import print_function
+import os, sys, time, json, csv, cProfile
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+
+import config
+
+class SentenceTimer(object):
+    '''Accumulates (step, wall seconds, CPU seconds) measurements for one sentence.'''
+    def __init__(self, sentenceId):
+        self.sentenceId = sentenceId
+        self.steps = []
+
+_profiles = {}  # step name -> cProfile.Profile for this process
+
+@contextmanager
+def timed(timer, name):
+    '''
+    Times the enclosed block as step 'name' of the sentence being timed,
+    and profiles it if config.profileDir is set. A no-op if 'timer' is None.
+    '''
+    if timer is None:
+        yield
+        return
+    prof = None
+    if config.profileDir:
+        prof = _profiles.get(name)
+        if prof is None:
+            prof = _profiles[name] = cProfile.Profile()
+    wall, cpu = time.time(), time.clock()   # time.clock() is processor time on Unix
+    if prof: prof.enable()
+    try:
+        yield
+    finally:
+        if prof: prof.disable()
+        timer.steps.append((name, time.time()-wall, time.clock()-cpu))
+
+def dump_profiles(suffix=''):
+    '''Writes the cProfile statistics collected in this process to one file per step
+    in config.profileDir, e.g. coref.prof (or coref.<suffix>.prof). Load with pstats.'''
+    if not os.path.isdir(config.profileDir):
+        os.makedirs(config.profileDir)
+    for name,prof in _profiles.items():
+        prof.dump_stats(os.path.join(config.profileDir, name+(suffix and '.'+suffix)+'.prof'))
+
+def percentile(sortedvals, p):
+    '''Nearest-rank percentile of a sorted list.
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 90)
+    4
+    '''
+    if not sortedvals: return None
+    k = max(0, min(len(sortedvals)-1, int(-(-p*len(sortedvals)//100))-1))
+    return sortedvals[k]
+
+class TimingReport(object):
+    '''
+    Collects per-sentence step timings and writes a report with per-step totals
+    and percentiles, and the slowest sentences.
+    '''
+    def __init__(self, nSlowest=10):
+        self.nSlowest = nSlowest
+        self._order = []    # step names in order of first occurrence
+        self._wall = defaultdict(list)
+        self._cpu = defaultdict(list)
+        self._sentences = []    # (total wall time, sentence ID, steps)
+
+    def add(self, sentenceId, steps):
+        for name,wall,cpu in steps:
+            if name not in self._wall:
+                self._order.append(name)
+            self._wall[name].append(wall)
+            self._cpu[name].append(cpu)
+        self._sentences.append((sum(wall for name,wall,cpu in steps), sentenceId, steps))
+
+    def summary(self):
+        stages = []
+        for name in self._order:
+            wall = sorted(self._wall[name])
+            stages.append(OrderedDict([('stage', name), ('count', len(wall)),
+                                       ('wall_total', sum(wall)), ('cpu_total', sum(self._cpu[name])),
+                                       ('wall_mean', sum(wall)/len(wall)),
+                                       ('wall_p50', percentile(wall, 50)), ('wall_p90', percentile(wall, 90)),
+                                       ('wall_p99', percentile(wall, 99)), ('wall_max', wall[-1])]))
+        slowest = [OrderedDict([('sentence', sentenceId), ('wall_total', total),
+                                ('stages', OrderedDict((name, wall) for name,wall,cpu in steps))])
+                   for total,sentenceId,steps in sorted(self._sentences, key=lambda s: -s[0])[:self.nSlowest]]
+        return OrderedDict([('sentences', len(self._sentences)),
+                            ('wall_total', sum(total for total,sentenceId,steps in self._sentences)),
+                            ('stages', stages), ('slowest', slowest)])
+
+    def write(self, path):
+        '''Writes the report as CSV if 'path' ends with .csv, otherwise as JSON.'''
+        summ = self.summary()
+        with open(path, 'wb') as outF:
+            if path.endswith('.csv'):
+                fields = ['stage', 'count', 'wall_total', 'cpu_total', 'wall_mean', 'wall_p50', 'wall_p90', 'wall_p99', 'wall_max']
+                w = csv.writer(outF)
+                w.writerow(['section']+fields)
+                for stage in summ['stages']:
+                    w.writerow(['stage']+[stage[f] for f in fields])
+                w.writerow([])
+                w.writerow(['section', 'sentence', 'wall_total']+self._order)
+                for sent in summ['slowest']:
+                    w.writerow(['slowest', sent['sentence'], sent['wall_total']]+[sent['stages'].get(name,'') for name in self._order])
+            else:
+                json.dump(summ, outF, indent=2)
+                outF.write('\n')
+
+if __name__=='__main__':
+    import doctest
+    doctest.testmod()
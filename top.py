@@ -9,12 +9,11 @@ from __future__ import print_function
 import os, sys, re, codecs, fileinput
 
 import pipeline
-from pipeline import highest
 
-def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, completed):
+def main(sentenceId, sentence, tokens, ww, wTags, depParse, inAMR, alignment, completed):
     amr = inAMR
     
-    h = highest([i for v,i in alignment[:]], depParse)
+    h = sentence.index.highest([i for v,i in alignment[:]])
     
     amr.node_to_concepts[str(alignment[:h])] += '-ROOT'
 
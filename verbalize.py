@@ -11,9 +11,9 @@ import os, sys, re, codecs, fileinput
 import pipeline
 from pipeline import new_concept, new_amr, new_amr_from_old
 
-def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, completed):
+def main(sentenceId, sentence, tokens, ww, wTags, depParse, inAMR, alignment, completed):
     amr = inAMR
-    triples = amr.triples(instances=False)
+    triples = list(amr.triples(instances=False))
     
     # find noun propositions in the AMR. extract edges of the form (x / xword :-PRED (y / lemma-n.01))
     npropedges = [trip for trip in triples if trip[1]=='-PRED']
@@ -67,13 +67,15 @@ def nompred2verbpred(nompred):
     '''
     global _npred2vpred
     if not _npred2vpred:
+        lex = {}    # published only once complete, so that an interrupted load is retried
         with open('nombank-deverbals-combined.txt') as inF:
             for ln in inF:
                 npred, vpred, arg = ln[:-1].split('\t')
-                if npred in _npred2vpred:
-                    assert _npred2vpred[npred]==vpred
+                if npred in lex:
+                    assert lex[npred]==vpred
                 else:
-                    _npred2vpred[npred] = vpred
+                    lex[npred] = vpred
+        _npred2vpred = lex
     return _npred2vpred.get(nompred)
 
 if __name__=='__main__':
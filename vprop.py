@@ -8,7 +8,7 @@ from __future__ import print_function
 import os, sys, re, codecs, fileinput, json
 
 import pipeline, config, timex
-from pipeline import Atom, choose_head, new_concept_from_token, new_amr_from_old
+from pipeline import Atom, new_concept_from_token, new_amr_from_old
 
 '''
 Example input, from wsj_0002.0:
@@ -56,11 +56,11 @@ Example input, from wsj_0002.0:
 
 
 
-def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, completed):
+def main(sentenceId, sentence, tokens, ww, wTags, depParse, inAMR, alignment, completed):
     amr = inAMR
     triples = set() # to add to the AMR
     
-    props = pipeline.loadVProp(jsonFile)
+    props = pipeline.loadVProp(sentence)
     
     # add all predicates first, so the roleset properly goes into the AMR
     for prop in props:
@@ -97,7 +97,7 @@ def main(sentenceId, jsonFile, tokens, ww, wTags, depParse, inAMR, alignment, co
                 #assert depParse[i], (tokens[i],rel,treenode,yieldS)
                 if depParse[i] is None: continue    # TODO: is this appropriate? e.g. in wsj_0003.0
             #print(roleset,rel,i,j,yieldS)
-            h = choose_head(range(i,j+1), depParse)
+            h = sentence.index.choose_head(i, j)
             if h is None: continue  # TODO: temporary?
             x = alignment[:h] # index of variable associated with i's head, if any
             